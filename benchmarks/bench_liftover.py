@@ -0,0 +1,360 @@
+import click
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from segment_liftover.chainIndex import default_chains, findChain, loadChain
+
+
+
+##########################################################################
+#
+#                   Benchmarks of segment_liftover
+#
+##########################################################################
+
+# Synthetic segment and probe files are converted by the command line
+# program, one case (chain, file type, scale) per process, so that the
+# peak memory of every case is measured on its own.
+#
+# The time of the conversion is split into stages as recorded by the
+# program in logs/metrics.json, see segment_liftover/metrics.py: read,
+# bed, liftover, remap, qc, write and other.
+
+# rows per file
+SCALES = {'1k': 1000, '100k': 100000, '10m': 10000000}
+
+# segments per sample in segment files
+SEGMENTS_PER_SAMPLE = 50
+
+# chromosomes of the synthetic files
+CHROMOSOMES = [str(i) for i in range(1, 23)] + ['X', 'Y']
+
+
+
+
+##########################################################################
+#
+#                   Synthetic data
+#
+##########################################################################
+
+# Lengths of the chromosomes of the source assembly of a chain,
+# from the end of the last block of every chromosome
+def chromosomeLengths(chain_path):
+
+    index = loadChain(chain_path)
+    lengths = {}
+    for chro in CHROMOSOMES:
+        ends = index.ends.get('chr' + chro)
+        if ends is not None and len(ends) > 0:
+            lengths[chro] = int(ends[-1])
+    return lengths
+
+
+
+
+# Positions of a synthetic array platform, sorted by chromosome and position
+#
+# Params:
+# lengths: see chromosomeLengths()
+# size: the number of positions
+# rng: a numpy random generator
+#
+# Return:
+# arrays of chromosome names and positions
+def platformPositions(lengths, size, rng):
+
+    chros = np.array(list(lengths), dtype=object)
+    weights = np.array([lengths[c] for c in chros], dtype=float)
+    picked = np.sort(rng.choice(len(chros), size, p=weights / weights.sum()))
+    positions = (rng.random(size) * np.array([lengths[c] for c in chros])[picked]).astype(np.int64)
+    order = np.lexsort((positions, picked))
+    return chros[picked[order]], positions[order]
+
+
+
+
+# Write synthetic segment files
+#
+# Segments start and end at positions of a platform, so samples share
+# breakpoints as they do with real array data. Most positions can be
+# converted directly, the ones in unaligned regions need approximate
+# conversion.
+#
+# Params:
+# paths: the files to write
+# lengths: see chromosomeLengths()
+# rows: the number of segments per file
+# rng: a numpy random generator
+def writeSegmentFiles(paths, lengths, rows, rng):
+
+    chros, positions = platformPositions(lengths, max(1000, rows // 10), rng)
+    for path in paths:
+        first = rng.integers(0, len(positions) - 1, rows)
+        last = np.minimum(first + rng.geometric(0.05, rows), len(positions) - 1)
+        # segments do not span chromosomes
+        ok = (chros[last] == chros[first]) & (positions[last] > positions[first])
+        first = first[ok]
+        last = last[ok]
+        df = pd.DataFrame({'sample_id': ['SAMPLE_{}'.format(i // SEGMENTS_PER_SAMPLE) for i in range(len(first))],
+                           'chromosome': chros[first],
+                           'start': positions[first],
+                           'stop': positions[last],
+                           'value': np.round(rng.normal(0, 0.3, len(first)), 4),
+                           'probes': last - first + 1})
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_csv(path, sep='\t', index=False)
+
+
+
+
+# Write synthetic probe files, all of the same platform
+#
+# Params:
+# see writeSegmentFiles()
+def writeProbeFiles(paths, lengths, rows, rng):
+
+    chros, positions = platformPositions(lengths, rows, rng)
+    ids = ['PROBE_{}'.format(i) for i in range(rows)]
+    for path in paths:
+        df = pd.DataFrame({'probe_id': ids, 'chromosome': chros, 'position': positions,
+                           'value': rng.normal(0, 0.3, rows)})
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_csv(path, sep='\t', index=False, float_format='%.4f')
+
+
+
+
+# Generate the input files of a case, once per source assembly
+#
+# Return:
+# the input directory
+def caseInput(workdir, chain, kind, scale, files, seed):
+
+    source = chain.split('To')[0] if chain in default_chains else os.path.basename(chain)
+    input_dir = os.path.join(workdir, 'inputs', '{}_{}_{}_{}'.format(source, kind, scale, files))
+    paths = [os.path.join(input_dir, 'sample_{}'.format(i), kind + 's.tsv') for i in range(files)]
+    if all(os.path.isfile(p) for p in paths):
+        return input_dir
+
+    rng = np.random.default_rng(seed)
+    lengths = chromosomeLengths(findChain(chain))
+    if kind == 'segment':
+        writeSegmentFiles(paths, lengths, SCALES[scale], rng)
+    else:
+        writeProbeFiles(paths, lengths, SCALES[scale], rng)
+    return input_dir
+
+
+
+
+##########################################################################
+#
+#                   Running a case
+#
+##########################################################################
+
+# Run one case with the command line program, in this process
+#
+# Params:
+# case: a dict with chain, kind, input_dir, output_dir, args and result
+#       (the path of the result file)
+def runCase(case):
+
+    from segment_liftover import segmentLiftover as sl
+
+    # the chain is loaded before the conversion
+    start = time.perf_counter()
+    chain_path = findChain(case['chain'])
+    sl.getChainIndex(chain_path)
+    chain_seconds = time.perf_counter() - start
+
+    pattern = '-si' if case['kind'] == 'segment' else '-pi'
+    args = ['-i', case['input_dir'], '-o', case['output_dir'], '-c', case['chain'],
+            pattern, case['kind'] + 's.tsv'] + case['args']
+    os.makedirs(case['output_dir'], exist_ok=True)
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        stdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            sl.cli.main(args, standalone_mode=False)
+        finally:
+            sys.stdout = stdout
+            subprocess.call(['rm', '-rf', sl.tmp_dir])
+    total = time.perf_counter() - start
+
+    with open(os.path.join(case['output_dir'], 'logs', 'metrics.json'), 'r') as fi:
+        metrics = json.load(fi)
+    if case['kind'] == 'segment':
+        positions = 2 * metrics['segments']['total']
+    else:
+        positions = metrics['probes']['total']
+
+    result = {'seconds': total,
+              'chain_seconds': chain_seconds,
+              'convert_seconds': metrics['convert_seconds'],
+              'stages': metrics['stages'],
+              'positions': int(positions),
+              'failed_files': len(sl.failed_files),
+              'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    with open(case['result'], 'w') as fo:
+        json.dump(result, fo)
+
+
+
+
+# Run one case in its own process
+#
+# Return:
+# the result dict of runCase(), with the case settings and rates
+def runCaseProcess(workdir, chain, kind, scale, files, seed, extra_args):
+
+    input_dir = caseInput(workdir, chain, kind, scale, files, seed)
+    name = '{}_{}_{}'.format(os.path.basename(chain), kind, scale)
+    case = {'chain': chain, 'kind': kind, 'input_dir': input_dir,
+            'output_dir': os.path.join(workdir, 'outputs', name),
+            'result': os.path.join(workdir, name + '.json'),
+            'args': list(extra_args)}
+    subprocess.run(['rm', '-rf', case['output_dir']])
+
+    cmd = [sys.executable, os.path.abspath(__file__), '--run_case', json.dumps(case)]
+    done = subprocess.run(cmd, cwd=workdir)
+    if done.returncode != 0:
+        return {'chain': chain, 'kind': kind, 'scale': scale, 'files': files, 'error': done.returncode}
+
+    with open(case['result'], 'r') as fi:
+        result = json.load(fi)
+    result.update({'chain': chain, 'kind': kind, 'scale': scale, 'rows_per_file': SCALES[scale],
+                   'files': files,
+                   'files_per_second': files / result['seconds'],
+                   'positions_per_second': result['positions'] / result['seconds']})
+    return result
+
+
+
+
+##########################################################################
+#
+#                   Reports
+#
+##########################################################################
+
+# Print results as a table
+def printResults(results):
+
+    print('{:<12} {:<8} {:>5} {:>9} {:>8} {:>12} {:>8}  {}'.format(
+          'chain', 'kind', 'scale', 'seconds', 'files/s', 'positions/s', 'rss_mb', 'read/write/liftover/remap/qc/other'))
+    for r in results:
+        if 'error' in r:
+            print('{:<12} {:<8} {:>5}  failed with code {}'.format(os.path.basename(r['chain']), r['kind'], r['scale'], r['error']))
+            continue
+        s = r['stages']
+        print('{:<12} {:<8} {:>5} {:>9.2f} {:>8.2f} {:>12.0f} {:>8.0f}  {}'.format(
+              os.path.basename(r['chain']), r['kind'], r['scale'], r['seconds'], r['files_per_second'],
+              r['positions_per_second'], r['peak_rss_mb'],
+              '/'.join('{:.2f}'.format(s[k]) for k in ['read', 'write', 'liftover', 'remap', 'qc', 'other'])))
+
+
+
+
+# Compare two result files, case by case
+def compareResults(old_path, new_path):
+
+    with open(old_path, 'r') as fi:
+        old = json.load(fi)
+    with open(new_path, 'r') as fi:
+        new = json.load(fi)
+    old_cases = {(r['chain'], r['kind'], r['scale']): r for r in old['results'] if 'error' not in r}
+
+    print('{:<12} {:<8} {:>5} {:>10} {:>10} {:>8} {:>10}'.format(
+          'chain', 'kind', 'scale', 'old_s', 'new_s', 'speedup', 'rss_ratio'))
+    for r in new['results']:
+        key = (r['chain'], r['kind'], r['scale'])
+        if 'error' in r or key not in old_cases:
+            continue
+        o = old_cases[key]
+        print('{:<12} {:<8} {:>5} {:>10.2f} {:>10.2f} {:>8.2f} {:>10.2f}'.format(
+              os.path.basename(r['chain']), r['kind'], r['scale'], o['seconds'], r['seconds'],
+              o['seconds'] / r['seconds'], r['peak_rss_mb'] / o['peak_rss_mb']))
+
+
+
+
+##########################################################################
+#
+#                   Main
+#
+##########################################################################
+@click.command(context_settings=dict(ignore_unknown_options=True))
+@click.option('--scales', default='1k,100k', help='Rows per file, comma separated, of {} (default:1k,100k).'.format(','.join(SCALES)))
+@click.option('--files', default=3, type=click.IntRange(min=1), help='The number of files per case (default:3).')
+@click.option('--chains', default=','.join(default_chains), help='Chains to benchmark, comma separated (default: all bundled chains).')
+@click.option('--kinds', default='segment,probe', help='File types to benchmark, comma separated (default:segment,probe).')
+@click.option('--workdir', default='benchmark_data', help='The directory of synthetic inputs and outputs (default:benchmark_data).')
+@click.option('--output', 'output_path', default=None, help='The JSON file of results (default: <workdir>/results_<time>.json).')
+@click.option('--seed', default=1, help='Seed of the synthetic data (default:1).')
+@click.option('--compare', nargs=2, type=str, default=None, help='Compare two result files and exit.')
+@click.option('--run_case', default=None, hidden=True)
+@click.argument('extra_args', nargs=-1, type=click.UNPROCESSED)
+def bench(scales, files, chains, kinds, workdir, output_path, seed, compare, run_case, extra_args):
+    """Benchmark segment_liftover on synthetic files.
+
+    EXTRA_ARGS are passed to segment_liftover, e.g. -- --approximate_mode stepwise
+    """
+
+    if run_case:
+        runCase(json.loads(run_case))
+        return
+    if compare:
+        compareResults(*compare)
+        return
+
+    scales = scales.split(',')
+    for scale in scales:
+        if scale not in SCALES:
+            sys.exit('Error: unknown scale {}.'.format(scale))
+    workdir = os.path.abspath(workdir)
+    os.makedirs(workdir, exist_ok=True)
+
+    results = []
+    for chain in chains.split(','):
+        if findChain(chain) is None:
+            sys.exit('Error: chainfile {} does not exist.'.format(chain))
+        for kind in kinds.split(','):
+            for scale in scales:
+                print('Running {} {} {}...'.format(chain, kind, scale))
+                results.append(runCaseProcess(workdir, chain, kind, scale, files, seed, extra_args))
+
+    report = {'time': datetime.now().isoformat(),
+              'git': subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip(),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'pandas': pd.__version__,
+              'machine': platform.platform(),
+              'args': list(extra_args),
+              'results': results}
+    if output_path is None:
+        output_path = os.path.join(workdir, 'results_{}.json'.format(datetime.now().strftime('%Y%m%d_%H%M%S')))
+    with open(output_path, 'w') as fo:
+        json.dump(report, fo, indent=1)
+
+    print()
+    printResults(results)
+    print('\nResults saved in {}'.format(output_path))
+
+
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,177 @@
+import click
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+examples_dir = os.path.join(repo_dir, 'segment_liftover', 'examples')
+
+
+
+##########################################################################
+#
+#                   Start up time of segment_liftover
+#
+##########################################################################
+
+# The command line program is started in new processes, as by the
+# segment_liftover script, and timed from the start of the process to
+# its exit. The cases do little work, so the time is mostly the start
+# up of Python and the imports of the program:
+#   python  the interpreter alone, the lower bound
+#   help    segment_liftover --help
+#   index   segment_liftover -f, the file indexing of the example files,
+#           the first work of a run before files are converted
+#
+# Every case is also run once with python -X importtime, to list the
+# heavy modules it imports.
+
+# what the segment_liftover script runs
+ENTRY = 'from segment_liftover.segmentLiftover import main; main()'
+
+# -f ends the run with sys.exit('Indexing file created.'), code 1
+EXIT_CODES = {'index': 1}
+
+# modules a run should not import before it converts files
+HEAVY_MODULES = ['numpy', 'pandas', 'multiprocessing', 'http.server', 'distutils', 'pkg_resources', 'cProfile']
+
+
+
+
+# The command lines of the cases
+#
+# Params:
+# workdir: the directory of the outputs of the index case
+def caseCommands(workdir):
+
+    return {'python': [sys.executable, '-c', 'pass'],
+            'help': [sys.executable, '-c', ENTRY, '--help'],
+            'index': [sys.executable, '-c', ENTRY, '-i', examples_dir, '-o', os.path.join(workdir, 'outputs'),
+                      '-c', 'hg18ToHg19', '-si', 'segments.tsv', '-pi', 'probes.tsv', '-f']}
+
+
+
+
+# The environment of the cases, the package is imported from this repository
+def caseEnv():
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.abspath(repo_dir)] + [p for p in [env.get('PYTHONPATH')] if p])
+    return env
+
+
+
+
+# Time a command line
+#
+# Params:
+# cmd: the command line
+# workdir: its working directory
+# repeats: the number of timed runs, after one run to warm up
+# code: the exit code of the command line
+#
+# Return:
+# the milliseconds of every run
+def timeCommand(cmd, workdir, repeats, code=0):
+
+    env = caseEnv()
+    times = []
+    for i in range(repeats + 1):
+        start = time.perf_counter()
+        done = subprocess.run(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = (time.perf_counter() - start) * 1000
+        if done.returncode != code:
+            sys.exit('Error: {} failed with code {}.'.format(' '.join(cmd), done.returncode))
+        if i > 0:
+            times.append(elapsed)
+    return times
+
+
+
+
+# The heavy modules imported by a command line, see HEAVY_MODULES
+#
+# Return:
+# a dict of module name and cumulative import time in milliseconds
+def heavyImports(cmd, workdir):
+
+    done = subprocess.run([cmd[0], '-X', 'importtime'] + cmd[1:], cwd=workdir, env=caseEnv(),
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    imports = {}
+    for line in done.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].strip()
+        if name in HEAVY_MODULES:
+            imports[name] = int(fields[1]) / 1000
+    return imports
+
+
+
+
+##########################################################################
+#
+#                   Main
+#
+##########################################################################
+@click.command()
+@click.option('--repeats', default=20, type=click.IntRange(min=1), help='Timed runs per case (default:20).')
+@click.option('--budget', default=100.0, type=click.FLOAT, help='Milliseconds the median of the help and index cases must stay under (default:100).')
+@click.option('--workdir', default='benchmark_data', help='The directory of the outputs (default:benchmark_data).')
+@click.option('--output', 'output_path', default=None, help='The JSON file of results (default: <workdir>/startup_<time>.json).')
+def bench(repeats, budget, workdir, output_path):
+    """Benchmark the start up time of segment_liftover.
+
+    Exits with code 1 if a case takes longer than the budget.
+    """
+
+    workdir = os.path.abspath(workdir)
+    os.makedirs(workdir, exist_ok=True)
+
+    results = []
+    for name, cmd in caseCommands(workdir).items():
+        print('Running {}...'.format(name))
+        times = timeCommand(cmd, workdir, repeats, EXIT_CODES.get(name, 0))
+        results.append({'case': name,
+                        'median_ms': statistics.median(times),
+                        'min_ms': min(times),
+                        'max_ms': max(times),
+                        'heavy_imports': heavyImports(cmd, workdir) if name != 'python' else {}})
+
+    report = {'time': datetime.now().isoformat(),
+              'git': subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=repo_dir,
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip(),
+              'python': platform.python_version(),
+              'machine': platform.platform(),
+              'repeats': repeats,
+              'budget_ms': budget,
+              'results': results}
+    if output_path is None:
+        output_path = os.path.join(workdir, 'startup_{}.json'.format(datetime.now().strftime('%Y%m%d_%H%M%S')))
+    with open(output_path, 'w') as fo:
+        json.dump(report, fo, indent=1)
+
+    print()
+    print('{:<8} {:>10} {:>8} {:>8}  {}'.format('case', 'median_ms', 'min_ms', 'max_ms', 'heavy imports (ms)'))
+    over = []
+    for r in results:
+        imports = ', '.join('{} {:.0f}'.format(k, v) for k, v in r['heavy_imports'].items()) or '-'
+        print('{:<8} {:>10.1f} {:>8.1f} {:>8.1f}  {}'.format(r['case'], r['median_ms'], r['min_ms'], r['max_ms'], imports))
+        if r['case'] != 'python' and r['median_ms'] > budget:
+            over.append(r['case'])
+    print('\nResults saved in {}'.format(output_path))
+
+    if over:
+        sys.exit('Over the budget of {:.0f} ms: {}'.format(budget, ', '.join(over)))
+
+
+
+
+if __name__ == '__main__':
+    bench()
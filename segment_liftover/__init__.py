@@ -0,0 +1 @@
+from segment_liftover.liftApi import liftSegments, liftPositions, LIFTED, REMAPPED, UNMAPPED, REJECTED_CHRO, REJECTED_LENGTH
@@ -0,0 +1,583 @@
+import gzip
+import hashlib
+import json
+import os
+from segment_liftover.lazy import LazyModule
+
+np = LazyModule('numpy')
+
+
+# chain files shipped with the package, can be given by name
+chains_dir = os.path.join(os.path.dirname(__file__), 'chains')
+default_chains = ['hg18ToHg19', 'hg18ToHg38', 'hg19ToHg38','hg38ToHg19','hg19ToHg18']
+
+
+
+##########################################################################
+#
+#                   Chain file parsing
+#
+##########################################################################
+
+# Read the ungapped alignment blocks of a UCSC chain file
+#
+# Params:
+# path: path of the chain file, plain text or gzipped
+#
+# Return:
+# a dict, key = source chromosome,
+# value = a list of [start, end, new_chr, strand, offset]
+#
+# Note: a position p in a block is converted to offset + p on the '+' strand,
+# and to offset - p on the '-' strand.
+def readChain(path):
+
+    opener = gzip.open if path.endswith('.gz') else open
+    blocks = {}
+
+    with opener(path, 'rt') as f:
+        for line in f:
+            line = line.split()
+            if len(line) == 0:
+                continue
+
+            # header line: chain score tName tSize tStrand tStart tEnd
+            #              qName qSize qStrand qStart qEnd id
+            if line[0] == 'chain':
+                chro = line[2]
+                t_pos = int(line[5])
+                new_chro = line[7]
+                q_size = int(line[8])
+                strand = line[9]
+                q_pos = int(line[10])
+                chro_blocks = blocks.setdefault(chro, [])
+                continue
+
+            # alignment line: size [dt dq]
+            size = int(line[0])
+            if strand == '+':
+                offset = q_pos - t_pos
+            else:
+                offset = q_size - 1 - q_pos + t_pos
+            chro_blocks.append([t_pos, t_pos + size, new_chro, strand, offset])
+            if len(line) == 3:
+                t_pos += size + int(line[1])
+                q_pos += size + int(line[2])
+
+    return blocks
+
+
+
+
+# MD5 checksum of a chain file, identifies cached conversion results.
+# A compiled index gives the checksum of the chain file it was made from,
+# a list of chains the checksum of their composition.
+def chainChecksum(path):
+
+    if isinstance(path, (list, tuple)):
+        checksum = chainChecksum(path[0])
+        for p in path[1:]:
+            checksum = composedChecksum([checksum, chainChecksum(p)])
+        return checksum
+    if isCompiledChain(path):
+        return readCompiledHeader(path)[0]['checksum']
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+
+
+# Split overlapping blocks into disjoint pieces
+#
+# Params:
+# blocks: a list of blocks on one chromosome, sorted by start
+#
+# Return:
+# a list of non-overlapping blocks.
+#
+# Note: like liftOver, bases covered by more than one block are
+# "Duplicated in new" and left out, so they stay unmapped.
+def flattenBlocks(blocks):
+
+    # fast path, chains rarely overlap
+    cover_end = -1
+    for b in blocks:
+        if b[0] < cover_end:
+            break
+        cover_end = b[1]
+    else:
+        return blocks
+
+    # sweep over all block boundaries, keep pieces covered exactly once
+    events = []
+    for i, b in enumerate(blocks):
+        events.append((b[0], 1, i))
+        events.append((b[1], 0, i))
+    events.sort()
+
+    pieces = []
+    active = set()
+    last = None
+    for pos, is_start, i in events:
+        if last is not None and pos > last and len(active) == 1:
+            b = blocks[next(iter(active))]
+            if pieces and pieces[-1][1] == last and pieces[-1][2:] == b[2:]:
+                pieces[-1][1] = pos
+            else:
+                pieces.append([last, pos] + b[2:])
+        if is_start:
+            active.add(i)
+        else:
+            active.discard(i)
+        last = pos
+
+    return pieces
+
+
+
+
+##########################################################################
+#
+#                   Chain index
+#
+##########################################################################
+
+# In-memory replacement of the UCSC liftOver program.
+#
+# The blocks of each source chromosome are kept in sorted NumPy arrays:
+# starts, ends, offsets, strands (1 or -1) and new_chr (code in names).
+# Positions are converted in batch, one searchsorted call per chromosome.
+class ChainIndex:
+
+    # Params:
+    # path: the chain file or compiled index
+    # checksum: MD5 checksum of the chain file
+    # names: chromosome names, the new_chr arrays hold indices in this list
+    # arrays: a dict, key = source chromosome,
+    #         value = (starts, ends, offsets, strands, new_chr)
+    def __init__(self, path, checksum, names, arrays):
+        self.path = path
+        self.checksum = checksum
+        self.names = names
+        self.codes = {chro: i for i, chro in enumerate(names)}
+        self.starts = {}
+        self.ends = {}
+        self.offsets = {}
+        self.strands = {}
+        self.new_chr = {}
+        # blocks mapped to the same chromosome name, for nearest search
+        self.same_chr = {}
+
+        for chro, (starts, ends, offsets, strands, new_chr) in arrays.items():
+            self.starts[chro] = starts
+            self.ends[chro] = ends
+            self.offsets[chro] = offsets
+            self.strands[chro] = strands
+            self.new_chr[chro] = new_chr
+
+
+    # Find the blocks containing the positions of one chromosome
+    #
+    # Return:
+    # an array of block indices, -1 for unmappable positions
+    def findBlocks(self, chro, positions):
+
+        if chro not in self.starts:
+            return np.full(len(positions), -1, dtype=np.int64)
+        i = np.searchsorted(self.starts[chro], positions, side='right') - 1
+        inside = (i >= 0)
+        inside[inside] = positions[inside] < self.ends[chro][i[inside]]
+        i[~inside] = -1
+        return i
+
+
+    # Convert positions of one chromosome through the given blocks
+    def mapBlocks(self, chro, positions, blocks):
+        return self.offsets[chro][blocks] + self.strands[chro][blocks] * positions
+
+
+    # Indices of the blocks that stay on a chromosome of the same name
+    def sameChroBlocks(self, chro):
+        if chro not in self.same_chr:
+            code = self.codes.get(chro, -1)
+            self.same_chr[chro] = np.flatnonzero(self.new_chr[chro] == code)
+        return self.same_chr[chro]
+
+
+    # Group array positions by chromosome name
+    #
+    # Return:
+    # a list of (chro, rows)
+    def groupByChro(self, chros):
+
+        names, inverse = np.unique(chros.astype(str), return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.cumsum(np.bincount(inverse, minlength=len(names)))
+        return [(chro, order[(bounds[k-1] if k > 0 else 0):bounds[k]]) for k, chro in enumerate(names)]
+
+
+    # Convert chromosome codes back to names, 'NA' for missing ones
+    def chroNames(self, codes):
+        found = codes >= 0
+        names = np.full(len(codes), 'NA', dtype=object)
+        names[found] = np.array(self.names, dtype=object)[codes[found]]
+        return names
+
+
+    # Convert single base positions
+    #
+    # Params:
+    # chros: an array of chromosome names
+    # positions: an array of positions
+    #
+    # Return:
+    # new chromosome names, new positions, and a boolean array of mapped
+    # positions. Unmapped positions get chromosome 'NA' and position -1.
+    def lift(self, chros, positions):
+
+        chros = np.asarray(chros, dtype=object)
+        positions = np.asarray(positions, dtype=np.int64)
+        new_codes = np.full(len(positions), -1, dtype=np.int32)
+        new_pos = np.full(len(positions), -1, dtype=np.int64)
+
+        for chro, rows in self.groupByChro(chros):
+            if chro not in self.starts:
+                continue
+            blocks = self.findBlocks(chro, positions[rows])
+            found = blocks >= 0
+            rows = rows[found]
+            blocks = blocks[found]
+            new_codes[rows] = self.new_chr[chro][blocks]
+            new_pos[rows] = self.mapBlocks(chro, positions[rows], blocks)
+
+        return self.chroNames(new_codes), new_pos, new_codes >= 0
+
+
+    # Find and convert the nearest mappable bases
+    #
+    # Params:
+    # chros: an array of chromosome names
+    # positions: an array of positions
+    # distance: the maximum distance to search, in bases
+    #
+    # Return:
+    # same as lift()
+    #
+    # Note: only bases mapped to a chromosome of the same name are used.
+    # The left and right neighbouring blocks are found by binary search,
+    # the closer one wins, the right one on a tie.
+    def nearest(self, chros, positions, distance):
+
+        chros = np.asarray(chros, dtype=object)
+        positions = np.asarray(positions, dtype=np.int64)
+        new_codes = np.full(len(positions), -1, dtype=np.int32)
+        new_pos = np.full(len(positions), -1, dtype=np.int64)
+
+        for chro, rows in self.groupByChro(chros):
+            if chro not in self.starts:
+                continue
+            same = self.sameChroBlocks(chro)
+            if len(same) == 0:
+                continue
+            starts = self.starts[chro][same]
+            ends = self.ends[chro][same]
+            pos = positions[rows]
+
+            # closest base of the block on the left, or inside the block
+            left = np.searchsorted(starts, pos, side='right') - 1
+            has_left = left >= 0
+            left_pos = np.where(has_left, np.minimum(ends[left] - 1, pos), -1)
+            left_dist = np.where(has_left, pos - left_pos, distance + 1)
+
+            # first base of the block on the right
+            right = left + 1
+            has_right = right < len(starts)
+            right = np.minimum(right, len(starts) - 1)
+            right_pos = np.where(has_right, starts[right], -1)
+            right_dist = np.where(has_right, right_pos - pos, distance + 1)
+
+            use_right = right_dist <= left_dist
+            best = np.where(use_right, right, left)
+            best_pos = np.where(use_right, right_pos, left_pos)
+            found = np.minimum(left_dist, right_dist) <= distance
+
+            rows = rows[found]
+            blocks = same[best[found]]
+            new_codes[rows] = self.new_chr[chro][blocks]
+            new_pos[rows] = self.mapBlocks(chro, best_pos[found], blocks)
+
+        return self.chroNames(new_codes), new_pos, new_codes >= 0
+
+
+
+
+# Parse a chain file into a ChainIndex
+def parseChain(path):
+
+    names = []
+    codes = {}
+    def chroCode(chro):
+        if chro not in codes:
+            codes[chro] = len(names)
+            names.append(chro)
+        return codes[chro]
+
+    arrays = {}
+    for chro, blocks in readChain(path).items():
+        blocks.sort(key=lambda b: b[0])
+        blocks = flattenBlocks(blocks)
+        arrays[chro] = (np.array([b[0] for b in blocks], dtype=np.int64),
+                        np.array([b[1] for b in blocks], dtype=np.int64),
+                        np.array([b[4] for b in blocks], dtype=np.int64),
+                        np.array([1 if b[3] == '+' else -1 for b in blocks], dtype=np.int8),
+                        np.array([chroCode(b[2]) for b in blocks], dtype=np.int32))
+
+    return ChainIndex(path, chainChecksum(path), names, arrays)
+
+
+
+
+# Find a chain file, the bundled chains can be given by name.
+# A bundled chain is replaced by its compiled index, if one was
+# compiled into chains_dir and compiled is True.
+#
+# Return:
+# the path of the chain file, or None if it does not exist
+def findChain(chain_file, compiled=True):
+
+    if chain_file in default_chains:
+        chain_file = os.path.join(chains_dir, chain_file + '.over.chain.gz')
+        compiled_file = os.path.join(chains_dir, compiledChainName(chain_file))
+        if compiled and os.path.isfile(compiled_file):
+            return compiled_file
+    if os.path.isfile(chain_file):
+        return chain_file
+    return None
+
+
+
+
+# Open a chain file or a compiled index as a ChainIndex.
+# A list of chains is composed into one, see composeChains().
+def loadChain(path):
+    if isinstance(path, (list, tuple)):
+        return composeChains([loadChain(p) for p in path])
+    if isCompiledChain(path):
+        return openCompiledChain(path)
+    return parseChain(path)
+
+
+
+
+##########################################################################
+#
+#                   Chain composition
+#
+##########################################################################
+
+# Checksum of a composed chain, from the checksums of its chains
+def composedChecksum(checksums):
+    return hashlib.md5(' '.join(checksums).encode('utf-8')).hexdigest()
+
+
+
+
+# Compose chains into one, e.g. hg18ToHg19 and hg19ToHg38 into hg18ToHg38
+#
+# Params:
+# indexes: a list of ChainIndex, the target assembly of each one is
+#          the source assembly of the next one
+#
+# Return:
+# a ChainIndex converting a position the same as converting it through
+# every chain in turn. A position unmapped by any chain is unmapped.
+#
+# Note: every block of the first chain is cut where its image meets the
+# blocks of the second chain, a piece maps p to
+# offset_2 + strand_2 * (offset_1 + strand_1 * p). More chains are
+# composed one after the other.
+def composeChains(indexes):
+
+    first = indexes[0]
+    for second in indexes[1:]:
+        arrays = {}
+        for chro in first.starts:
+            starts, ends = first.starts[chro], first.ends[chro]
+            offsets, strands = first.offsets[chro], first.strands[chro].astype(np.int64)
+
+            # image of the blocks in the target assembly, [lo, hi)
+            lo = np.where(strands == 1, offsets + starts, offsets - ends + 1)
+            hi = np.where(strands == 1, offsets + ends, offsets - starts + 1)
+
+            pieces = []
+            new_chr = first.new_chr[chro]
+            for code in np.unique(new_chr):
+                target = first.names[code]
+                if target not in second.starts:
+                    continue
+                rows = np.flatnonzero(new_chr == code)
+                t_starts, t_ends = second.starts[target], second.ends[target]
+
+                # blocks of the second chain overlapping each image
+                j0 = np.searchsorted(t_ends, lo[rows], side='right')
+                j1 = np.searchsorted(t_starts, hi[rows], side='left')
+                counts = np.maximum(j1 - j0, 0)
+                if counts.sum() == 0:
+                    continue
+                i = np.repeat(rows, counts)
+                j = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(j0, counts)
+                x0 = np.maximum(lo[i], t_starts[j])
+                x1 = np.minimum(hi[i], t_ends[j])
+
+                t_strands = second.strands[target][j].astype(np.int64)
+                pieces.append((np.where(strands[i] == 1, x0 - offsets[i], offsets[i] - x1 + 1),
+                               np.where(strands[i] == 1, x1 - offsets[i], offsets[i] - x0 + 1),
+                               second.offsets[target][j] + t_strands * offsets[i],
+                               (strands[i] * t_strands).astype(np.int8),
+                               second.new_chr[target][j]))
+
+            if not pieces:
+                continue
+            fields = [np.concatenate(f) for f in zip(*pieces)]
+            order = np.argsort(fields[0], kind='stable')
+            arrays[chro] = tuple(f[order] for f in fields)
+
+        paths = first.path if isinstance(first.path, list) else [first.path]
+        first = ChainIndex(paths + [second.path], composedChecksum([first.checksum, second.checksum]),
+                           second.names, arrays)
+
+    return first
+
+
+
+
+##########################################################################
+#
+#                   Compiled chain index
+#
+##########################################################################
+
+# A compiled index is a flat binary file:
+#
+#   magic        8 bytes, COMPILED_MAGIC
+#   header size  8 bytes, little endian
+#   header       JSON, padded to 8 bytes
+#   arrays       one array per field of COMPILED_FIELDS, blocks of all
+#                chromosomes back to back, each array padded to 8 bytes
+#
+# The header holds the chromosome names, the block range of every source
+# chromosome, the array offsets (counted from the end of the header),
+# and the checksum of the chain file.
+# The arrays are opened with np.memmap, so nothing is parsed at startup,
+# and processes using the same index share the same pages.
+COMPILED_MAGIC = b'SLCHAIN1'
+COMPILED_VERSION = 1
+COMPILED_FIELDS = [('starts', '<i8'), ('ends', '<i8'), ('offsets', '<i8'),
+                   ('strands', '<i1'), ('new_chr', '<i4')]
+COMPILED_SUFFIX = '.cidx'
+
+
+# Check if a file is a compiled index
+def isCompiledChain(path):
+    with open(path, 'rb') as f:
+        return f.read(len(COMPILED_MAGIC)) == COMPILED_MAGIC
+
+
+
+
+# Read the header of a compiled index
+#
+# Return:
+# the header dict, and the file offset of the arrays
+def readCompiledHeader(path):
+
+    with open(path, 'rb') as f:
+        if f.read(len(COMPILED_MAGIC)) != COMPILED_MAGIC:
+            raise ValueError('{} is not a compiled chain index'.format(path))
+        size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(size).decode('utf-8'))
+    if header['version'] != COMPILED_VERSION:
+        raise ValueError('{} has an unsupported index version {}'.format(path, header['version']))
+    return header, len(COMPILED_MAGIC) + 8 + size
+
+
+
+
+# Default name of the compiled index of a chain file
+def compiledChainName(path):
+    name = os.path.basename(path)
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return name + COMPILED_SUFFIX
+
+
+
+
+# Compile a chain file into a binary index
+#
+# Params:
+# path: the chain file, plain text or gzipped
+# out: the path of the compiled index
+#
+# Return:
+# the ChainIndex of the chain file
+def compileChain(path, out):
+
+    index = parseChain(path)
+    chros = sorted(index.starts)
+    bounds = np.cumsum([0] + [len(index.starts[chro]) for chro in chros])
+    header = {'version': COMPILED_VERSION,
+              'source': os.path.basename(path),
+              'checksum': index.checksum,
+              'names': index.names,
+              'chros': [[chro, int(bounds[i]), int(bounds[i+1])] for i, chro in enumerate(chros)],
+              'blocks': int(bounds[-1]),
+              'arrays': {}}
+
+    # array offsets are counted from the end of the header
+    data = []
+    pos = 0
+    for field, dtype in COMPILED_FIELDS:
+        arr = np.concatenate([getattr(index, field)[chro] for chro in chros]
+                             or [np.empty(0)]).astype(dtype)
+        header['arrays'][field] = pos
+        data.append(arr)
+        pos += arr.nbytes + (-arr.nbytes % 8)
+    text = json.dumps(header).encode('utf-8')
+    size = len(text) + (-len(text) % 8)
+    text = text.ljust(size)
+
+    tmp = out + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(COMPILED_MAGIC)
+        f.write(size.to_bytes(8, 'little'))
+        f.write(text)
+        for arr in data:
+            f.write(arr.tobytes())
+            f.write(bytes(-arr.nbytes % 8))
+    os.replace(tmp, out)
+
+    return index
+
+
+
+
+# Open a compiled index as a ChainIndex, the arrays are memory mapped
+def openCompiledChain(path):
+
+    header, start = readCompiledHeader(path)
+    total = header['blocks']
+    fields = {}
+    for field, dtype in COMPILED_FIELDS:
+        if total > 0:
+            fields[field] = np.memmap(path, dtype=dtype, mode='r',
+                                      offset=start + header['arrays'][field], shape=(total,))
+        else:
+            fields[field] = np.empty(0, dtype=dtype)
+
+    arrays = {chro: tuple(fields[field][begin:end] for field, _ in COMPILED_FIELDS)
+              for chro, begin, end in header['chros']}
+    return ChainIndex(path, header['checksum'], header['names'], arrays)
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+
+
+
+##########################################################################
+#
+#                   Crash safe outputs and progress
+#
+##########################################################################
+
+# Write an output file through a temp file next to it, which replaces
+# the output only once it is completely written and synced to disk.
+# If the writing fails, the temp file is removed and the output is left
+# as it was. The file is opened in text mode, or in binary mode if binary
+# is True.
+#
+# Usage:
+# with AtomicOutput(path) as f:
+#     df.to_csv(f)
+class AtomicOutput:
+
+    def __init__(self, path, binary=False):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.binary = binary
+
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self.binary:
+            self.file = open(self.tmp_path, 'wb')
+        else:
+            self.file = open(self.tmp_path, 'w', newline='')
+        return self.file
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            os.replace(self.tmp_path, self.path)
+        else:
+            self.file.close()
+            try:
+                os.remove(self.tmp_path)
+            except OSError:
+                pass
+        return False
+
+
+
+
+# Log handler of the progress journal, an append only list of finished files.
+# The file is synced to disk every sync_every records, and when closed.
+class JournalHandler(logging.FileHandler):
+
+    def __init__(self, path, mode='a', sync_every=100):
+        super().__init__(path, mode=mode, delay=True)
+        self.sync_every = sync_every
+        self.unsynced = 0
+
+
+    def emit(self, record):
+        super().emit(record)
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+
+    def sync(self):
+        if self.stream is not None:
+            self.stream.flush()
+            os.fsync(self.stream.fileno())
+        self.unsynced = 0
+
+
+    def close(self):
+        self.acquire()
+        try:
+            self.sync()
+        finally:
+            self.release()
+        super().close()
+
+
+
+
+# Read the files listed in a progress journal
+def readJournal(path):
+    if not os.path.isfile(path):
+        return set()
+    with open(path, 'r') as fi:
+        return set(line.strip() for line in fi)
+
+
+
+
+# The checkpoint of a job is saved when it starts converting files, and
+# cleared when it finishes. A checkpoint left behind means the job was
+# interrupted.
+#
+# Return:
+# the saved job description, None if there is no checkpoint
+def loadCheckpoint(path):
+    try:
+        with open(path, 'r') as fi:
+            return json.load(fi)
+    except (OSError, ValueError):
+        return None
+
+
+
+
+# Save the description of a job as its checkpoint, see loadCheckpoint()
+def saveCheckpoint(path, job):
+    with AtomicOutput(path) as fo:
+        json.dump(job, fo)
+
+
+
+
+# Clear the checkpoint of a finished job
+def clearCheckpoint(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
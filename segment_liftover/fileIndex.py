@@ -0,0 +1,160 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+##########################################################################
+#
+#                   File indexing
+#
+##########################################################################
+
+# Input files are found by scanning input_dir with os.scandir, each top
+# level sub-directory in its own thread. Files come out in the same order
+# as with os.walk.
+#
+# The scan is saved as an index with the mtime of every directory. A later
+# scan with the same input_dir and file name patterns lists a directory
+# again only if its mtime changed, the others are taken from the index.
+
+INDEX_VERSION = 1
+
+# directories changed less than this before a scan (in ns) are listed again
+# by the next one, as a later change could leave their mtime the same
+MTIME_MARGIN = 2 * 10**9
+
+
+# Read a saved index
+#
+# Params:
+# path: the index file
+# input_dir: the directory that is scanned
+# patterns: the file name patterns, the index is only used if they match
+#
+# Return:
+# a dict, key = directory path relative to input_dir,
+# value = [mtime_ns, sub-directories, matched files as [name, kind]]
+# empty if the index does not exist or does not fit.
+def loadFileIndex(path, input_dir, patterns):
+
+    try:
+        with open(path, 'r') as fi:
+            index = json.load(fi)
+    except (OSError, ValueError):
+        return {}
+    if (index.get('version') != INDEX_VERSION or index.get('input_dir') != os.path.abspath(input_dir)
+            or index.get('patterns') != list(patterns)):
+        return {}
+    recent = index['time'] - MTIME_MARGIN
+    return {rel: entry for rel, entry in index['dirs'].items() if entry[0] < recent}
+
+
+
+
+# Save the scanned directories as an index, see loadFileIndex()
+#
+# Params:
+# scan_time: when the scan started, in ns since the epoch
+def saveFileIndex(path, input_dir, patterns, dirs, scan_time):
+
+    index = {'version': INDEX_VERSION,
+             'input_dir': os.path.abspath(input_dir),
+             'patterns': list(patterns),
+             'time': scan_time,
+             'dirs': dirs}
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fo:
+        json.dump(index, fo)
+    os.replace(tmp, path)
+
+
+
+
+# Scan a directory tree, top down
+#
+# Params:
+# input_dir: the directory that is scanned
+# top: the root of the tree, relative to input_dir
+# match: a function returning the kind of a file name, None to skip it
+# cache: a loaded index, see loadFileIndex()
+# limit: stop after this number of directories
+#
+# Return:
+# a list of (relative directory path, [mtime_ns, sub-directories, files])
+#
+# Note: like os.walk, unreadable directories and symbolic links to
+# directories are skipped.
+def scanTree(input_dir, top, match, cache, limit=None):
+
+    scanned = []
+    stack = [top]
+    while stack and (limit is None or len(scanned) < limit):
+        rel = stack.pop()
+        path = os.path.join(input_dir, rel) if rel else input_dir
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            continue
+
+        entry = cache.get(rel)
+        if (entry is None) or (entry[0] != mtime):
+            subdirs = []
+            files = []
+            try:
+                with os.scandir(path) as it:
+                    for e in it:
+                        try:
+                            is_dir = e.is_dir()
+                        except OSError:
+                            is_dir = False
+                        if is_dir:
+                            if not e.is_symlink():
+                                subdirs.append(e.name)
+                        else:
+                            kind = match(e.name)
+                            if kind:
+                                files.append([e.name, kind])
+            except OSError:
+                continue
+            entry = [mtime, subdirs, files]
+
+        scanned.append((rel, entry))
+        stack.extend(os.path.join(rel, d) for d in reversed(entry[1]))
+
+    return scanned
+
+
+
+
+# Scan input_dir, the top level sub-directories in parallel
+#
+# Params:
+# input_dir, match, cache, limit: see scanTree()
+# threads: the number of threads, default of ThreadPoolExecutor if None
+#
+# Return:
+# a generator of scanned trees, see scanTree(): input_dir itself first,
+# then one per top level sub-directory, in os.walk order.
+def scanDirectories(input_dir, match, cache, limit=None, threads=None):
+
+    root = scanTree(input_dir, '', match, cache, limit=1)
+    yield root
+    if not root:
+        return
+
+    subdirs = root[0][1][1]
+    # in test mode the directories are scanned one by one up to limit
+    if limit is not None:
+        limit -= 1
+        for d in subdirs:
+            if limit <= 0:
+                break
+            tree = scanTree(input_dir, d, match, cache, limit)
+            limit -= len(tree)
+            yield tree
+        return
+
+    with ThreadPoolExecutor(threads) as pool:
+        for tree in pool.map(lambda d: scanTree(input_dir, d, match, cache), subdirs):
+            yield tree
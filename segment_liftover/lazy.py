@@ -0,0 +1,47 @@
+import importlib
+
+
+
+##########################################################################
+#
+#                   Lazy imports
+#
+##########################################################################
+
+# NumPy and pandas take most of the start up time of the program, and
+# runs like --help or --file_indexing do not need them. They are held as
+# LazyModule objects, which import the module on the first attribute
+# access, e.g. np.zeros. The import lock makes it safe from any thread.
+#
+# Usage:
+# np = LazyModule('numpy')
+class LazyModule:
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_loaded'] = None
+
+
+    def _module(self):
+        module = self.__dict__['_loaded']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_loaded'] = module
+        return module
+
+
+    def __getattr__(self, attr):
+        return getattr(self._module(), attr)
+
+
+    def __repr__(self):
+        return '<lazy module {}>'.format(self.__dict__['_name'])
+
+
+
+
+# Import lazy modules now, e.g. before forking worker processes
+# which would otherwise import them one by one
+def preload(*modules):
+    for module in modules:
+        module._module()
@@ -0,0 +1,185 @@
+from segment_liftover.chainIndex import ChainIndex, findChain, loadChain
+from segment_liftover.lazy import LazyModule
+
+np = LazyModule('numpy')
+
+
+
+##########################################################################
+#
+#                   Library interface
+#
+##########################################################################
+
+# Convert segments and positions held in memory with the built-in chain
+# engine, without writing or reading any file but the chain file.
+#
+# Every row gets a status code, the same quality control as the command
+# line is applied: unmapped positions, positions converted to another
+# chromosome, and segments whose length changes more than beta times.
+
+# Status codes
+LIFTED = 0          # converted directly
+REMAPPED = 1        # converted, at least one position approximately
+UNMAPPED = 2        # a position could not be converted
+REJECTED_CHRO = 3   # converted to another chromosome
+REJECTED_LENGTH = 4 # the segment length ratio is out of [1/beta, beta]
+
+# loaded chain files, key = chain path or tuple of composed chain paths,
+# value = ChainIndex
+chain_indexes = {}
+
+
+
+
+# Get the ChainIndex of a chain
+#
+# Params:
+# chain: a ChainIndex, the path of a chain file or compiled index,
+#        or the name of a bundled chain, e.g. 'hg19ToHg38'.
+#        A list of chains is composed into one, e.g.
+#        ['hg18ToHg19', 'hg19ToHg38'] converts from hg18 to hg38.
+def getChainIndex(chain):
+
+    if isinstance(chain, ChainIndex):
+        return chain
+    chains = list(chain) if isinstance(chain, (list, tuple)) else [chain]
+    paths = []
+    for c in chains:
+        path = findChain(c)
+        if path is None:
+            raise ValueError('chain file {} does not exist'.format(c))
+        paths.append(path)
+    key = paths[0] if len(paths) == 1 else tuple(paths)
+    if key not in chain_indexes:
+        chain_indexes[key] = loadChain(key)
+    return chain_indexes[key]
+
+
+
+
+# Chromosome names as used in chain files,
+# 'chr' is added to all names if the first one does not have it.
+def chainChroNames(chroms):
+
+    chroms = np.asarray(chroms).astype(str).astype(object)
+    if len(chroms) > 0 and 'chr' not in chroms[0]:
+        chroms = 'chr' + chroms
+    return chroms
+
+
+
+
+# Convert single bases, and approximately convert the unmapped ones
+# to the nearest mappable base within distance.
+#
+# Return:
+# new chromosome names, new positions, and status codes LIFTED,
+# REMAPPED or UNMAPPED. Unmapped positions get 'NA' and -1.
+def liftBases(index, chroms, positions, approximate, distance):
+
+    new_chroms, new_pos, mapped = index.lift(chroms, positions)
+    status = np.where(mapped, LIFTED, UNMAPPED).astype(np.int8)
+
+    if approximate and not mapped.all():
+        rows = np.flatnonzero(~mapped)
+        # chr23 and chr24 are searched as chrX and chrY
+        near_chroms = chroms[rows].copy()
+        near_chroms[near_chroms == 'chr23'] = 'chrX'
+        near_chroms[near_chroms == 'chr24'] = 'chrY'
+        near_chroms, near_pos, found = index.nearest(near_chroms, positions[rows], distance)
+        rows = rows[found]
+        new_chroms[rows] = near_chroms[found]
+        new_pos[rows] = near_pos[found]
+        status[rows] = REMAPPED
+
+    return new_chroms, new_pos, status
+
+
+
+
+# Quality control of converted segments
+#
+# Params:
+# chr_s, start_new: the converted start positions
+# chr_e, stop_new: the converted end positions
+# start_old, stop_old: the original positions
+# beta: the maximum change of the segment length
+#
+# Return:
+# status codes LIFTED, UNMAPPED, REJECTED_CHRO or REJECTED_LENGTH,
+# and the ratios of new to old segment lengths
+def segmentStatus(chr_s, start_new, chr_e, stop_new, start_old, stop_old, beta):
+
+    start_new = np.asarray(start_new, dtype=np.int64)
+    stop_new = np.asarray(stop_new, dtype=np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = (stop_new - start_new) / (np.asarray(stop_old, dtype=np.int64) - np.asarray(start_old, dtype=np.int64))
+
+    status = np.full(len(ratio), LIFTED, dtype=np.int8)
+    status[(ratio < (1/beta)) | (ratio > beta)] = REJECTED_LENGTH
+    status[np.asarray(chr_s) != np.asarray(chr_e)] = REJECTED_CHRO
+    status[(start_new == -1) | (stop_new == -1)] = UNMAPPED
+    return status, ratio
+
+
+
+
+# Convert single positions, e.g. probes
+#
+# Params:
+# chroms: chromosome names, with or without 'chr'
+# positions: positions
+# chain: see getChainIndex()
+# approximate: approximately convert unmapped positions
+# distance: the searching range of approximate conversion, in bases
+#
+# Return:
+# new chromosome names, new positions and status codes.
+# Positions converted to another chromosome are REJECTED_CHRO.
+def liftPositions(chroms, positions, chain, approximate=True, distance=10000):
+
+    index = getChainIndex(chain)
+    chroms = chainChroNames(chroms)
+    positions = np.asarray(positions, dtype=np.int64)
+
+    new_chroms, new_pos, status = liftBases(index, chroms, positions, approximate, distance)
+    status[(status != UNMAPPED) & (new_chroms != chroms)] = REJECTED_CHRO
+    return new_chroms, new_pos, status
+
+
+
+
+# Convert segments
+#
+# Params:
+# df: a DataFrame of segments, the first 4 columns are id, chromosome,
+#     start and end, without missing values
+# chain: see getChainIndex()
+# approximate: approximately convert unmapped positions
+# distance: the searching range of approximate conversion, in bases
+# beta: parameter of the quality control
+#
+# Return:
+# a copy of df with converted start and end, and status codes.
+# Rows are kept in place whatever their status, unmapped positions are -1.
+def liftSegments(df, chain, approximate=True, distance=10000, beta=2):
+
+    index = getChainIndex(chain)
+    chroms = chainChroNames(df.iloc[:, 1].values)
+    starts = np.asarray(df.iloc[:, 2].values, dtype=np.int64)
+    stops = np.asarray(df.iloc[:, 3].values, dtype=np.int64)
+
+    # a segment is converted by its first and last bases,
+    # the end of an approximately converted segment is not extended
+    chr_s, start_new, status_s = liftBases(index, chroms, starts, approximate, distance)
+    chr_e, stop_new, status_e = liftBases(index, chroms, stops - 1, approximate, distance)
+    stop_new[status_e == LIFTED] += 1
+
+    status, _ = segmentStatus(chr_s, start_new, chr_e, stop_new, starts, stops, beta)
+    status[(status == LIFTED) & ((status_s == REMAPPED) | (status_e == REMAPPED))] = REMAPPED
+
+    df_new = df.copy()
+    df_new.iloc[:, 2] = start_new
+    df_new.iloc[:, 3] = stop_new
+    return df_new, status
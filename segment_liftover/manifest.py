@@ -0,0 +1,68 @@
+import json
+import os
+import sqlite3
+
+
+
+##########################################################################
+#
+#                   Manifest of converted files
+#
+##########################################################################
+
+# Fingerprint of an input file and the settings it is converted with
+#
+# Params:
+# path: the input file
+# settings: a JSON serializable list of everything the output depends on,
+#           e.g. chain checksum, beta, approximate conversion parameters
+def fileFingerprint(path, settings):
+    st = os.stat(path)
+    return json.dumps([st.st_size, st.st_mtime_ns, settings])
+
+
+
+
+# Converted files kept in a SQLite file, for incremental runs.
+#
+# Each input file is recorded with the fingerprint it was converted with,
+# its output path, and the size and mtime of the output when it was
+# written. An output is current as long as all of them are unchanged.
+class Manifest:
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS manifest (
+                                input TEXT PRIMARY KEY, fingerprint TEXT,
+                                output TEXT, output_size INTEGER, output_mtime INTEGER
+                             )''')
+        self.conn.commit()
+
+
+    # Check if the output of an input file is current
+    def isCurrent(self, path, fingerprint, output):
+
+        row = self.conn.execute('SELECT fingerprint, output, output_size, output_mtime FROM manifest WHERE input = ?',
+                                (path,)).fetchone()
+        if (row is None) or (row[0] != fingerprint) or (row[1] != output):
+            return False
+        try:
+            st = os.stat(output)
+        except OSError:
+            return False
+        return (st.st_size == row[2]) and (st.st_mtime_ns == row[3])
+
+
+    # Record a converted file, after its output is written
+    def record(self, path, fingerprint, output):
+
+        st = os.stat(output)
+        self.conn.execute('INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?, ?)',
+                          (path, fingerprint, output, st.st_size, st.st_mtime_ns))
+        self.conn.commit()
+
+
+    def close(self):
+        self.conn.close()
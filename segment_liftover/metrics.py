@@ -0,0 +1,207 @@
+import csv
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+
+
+##########################################################################
+#
+#                   Run metrics
+#
+##########################################################################
+
+# The time of a run is split into stages:
+#   read      reading input files
+#   bed       writing the BED files of the liftOver program
+#   liftover  converting positions, with the built-in engine or liftOver
+#   remap     solveUnmappables, the approximate conversion
+#   qc        merging the results and the quality control
+#   write     writing output files
+#   other     the rest of the conversion of files
+# A stage started inside another one is counted in the outer one, e.g.
+# the liftBed calls of stepwise approximate conversion are counted in
+# remap. Stages of threads, e.g. with --prefetch, are counted as well, so
+# with threads or several processes the stages add up to more than the
+# wall time.
+#
+# The stages of a file are the ones run inside file(), in any thread, e.g.
+# the read ahead and the write behind of the file with --prefetch.
+
+STAGES = ['read', 'bed', 'liftover', 'remap', 'qc', 'write']
+
+# columns of the per file metrics
+FILE_COLUMNS = ['file', 'kind', 'code', 'rows', 'seconds'] + STAGES + ['other']
+
+
+# Seconds per stage, counts of events, e.g. cache hits, and per file
+# records of a run. The stats of worker processes are merged into the
+# ones of the main process, see take() and merge().
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # the active stage of every thread
+        self.local = threading.local()
+        self.reset()
+
+
+    def reset(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.counts = {}
+        self.files = []
+        # seconds per stage of every file, see file()
+        self.file_stages = {}
+
+
+    # Time a stage
+    #
+    # Usage:
+    # with metrics.stage('read'):
+    #     ...
+    @contextmanager
+    def stage(self, name):
+
+        if getattr(self.local, 'active', None) is not None:
+            yield
+            return
+        self.local.active = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.local.active = None
+            self.add(name, time.perf_counter() - start)
+
+
+    # Decorate a function to time it as a stage, see stage()
+    def timed(self, name):
+        def decorate(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+
+    # Count the stages run by this thread to a file
+    #
+    # Usage:
+    # with metrics.file(f):
+    #     ...
+    @contextmanager
+    def file(self, f):
+
+        previous = getattr(self.local, 'file', None)
+        self.local.file = f
+        try:
+            yield
+        finally:
+            self.local.file = previous
+
+
+    # Call fn(*args), its stages counted to the file f, e.g. in a thread
+    def inFile(self, f, fn, *args):
+        with self.file(f):
+            return fn(*args)
+
+
+    # Add seconds to a stage, and to the stage of the file of this thread
+    def add(self, name, seconds):
+        f = getattr(self.local, 'file', None)
+        with self.lock:
+            self.seconds[name] += seconds
+            if f is not None:
+                if f not in self.file_stages:
+                    self.file_stages[f] = dict.fromkeys(STAGES, 0.0)
+                self.file_stages[f][name] += seconds
+
+
+    # Count events
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + int(n)
+
+
+    # Seconds per stage of a file so far
+    def snapshot(self, f):
+        with self.lock:
+            return dict(self.file_stages.get(f, dict.fromkeys(STAGES, 0.0)))
+
+
+    # Record a converted file. Its stages are added once they are all
+    # done, e.g. after the write behind of the file, see records().
+    #
+    # Params:
+    # f, kind, code: see liftFile()
+    # rows: the number of rows of the file
+    # seconds: the time of its conversion
+    # before: the snapshot() of the file taken before its conversion
+    def addFile(self, f, kind, code, rows, seconds, before):
+
+        during = sum(self.snapshot(f).values()) - sum(before.values())
+        record = dict(file=f, kind=kind, code=code, rows=rows, seconds=seconds,
+                      other=max(0.0, seconds - during))
+        with self.lock:
+            self.files.append(record)
+
+
+    # The records of files, with their stages. Records taken from
+    # worker processes hold their stages already.
+    def records(self):
+        with self.lock:
+            return [dict(self.file_stages.get(record['file'], dict.fromkeys(STAGES, 0.0)), **record)
+                    for record in self.files]
+
+
+    # Return the stats and reset them, e.g. in a worker process
+    def take(self):
+        files = self.records()
+        with self.lock:
+            taken = (self.seconds, self.counts, files)
+            self.reset()
+        return taken
+
+
+    # Add stats returned by take()
+    def merge(self, taken):
+        seconds, counts, files = taken
+        with self.lock:
+            for name, value in seconds.items():
+                self.seconds[name] += value
+            for name, value in counts.items():
+                self.counts[name] = self.counts.get(name, 0) + value
+            self.files.extend(files)
+
+
+    # Write the metrics of a run
+    #
+    # Params:
+    # json_path: the summary, as JSON
+    # csv_path: one line per file, see FILE_COLUMNS
+    # summary: a dict of other stats of the run, e.g. wall time and counters
+    def write(self, json_path, csv_path, summary):
+
+        files = self.records()
+        stages = dict(self.seconds)
+        stages['other'] = sum(record['other'] for record in files)
+        convert_seconds = sum(record['seconds'] for record in files)
+        rows = sum(record['rows'] for record in files)
+        report = dict(summary)
+        report.update({'files': len(files),
+                       'rows': rows,
+                       'convert_seconds': convert_seconds,
+                       'rows_per_second': rows / convert_seconds if convert_seconds > 0 else None,
+                       'stages': stages,
+                       'counts': self.counts})
+        with open(json_path, 'w') as fo:
+            json.dump(report, fo, indent=2)
+
+        with open(csv_path, 'w', newline='') as fo:
+            writer = csv.DictWriter(fo, fieldnames=FILE_COLUMNS)
+            writer.writeheader()
+            for record in files:
+                writer.writerow(record)
@@ -0,0 +1,119 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+##########################################################################
+#
+#                   Read ahead and write behind
+#
+##########################################################################
+
+# Reading and writing files mostly waits for the disk or the network,
+# and pandas releases the GIL while it parses, so both are done in
+# threads while the main thread converts the files in between.
+# Every stage holds at most depth files, which caps the memory use.
+
+
+# Read files ahead in a thread pool, at most depth files ahead of the
+# one in use.
+#
+# Params:
+# files: the files, in the order they are used
+# read: a function reading a file, e.g. into a DataFrame
+# depth: the number of files read ahead
+#
+# Usage:
+# for f, table, error in ReadAhead(files, read, 4):
+#     ...
+# error is the exception raised by read(f), table is None then.
+class ReadAhead:
+
+    def __init__(self, files, read, depth):
+        self.files = iter(files)
+        self.read = read
+        self.depth = max(1, depth)
+        self.pool = ThreadPoolExecutor(self.depth)
+        self.queue = deque()
+
+
+    def __iter__(self):
+        try:
+            for f in self.files:
+                self.queue.append((f, self.pool.submit(self.read, f)))
+                if len(self.queue) > self.depth:
+                    yield self.take()
+            while self.queue:
+                yield self.take()
+        finally:
+            self.close()
+
+
+    # The next file in order, waits for it to be read
+    def take(self):
+        f, future = self.queue.popleft()
+        try:
+            return f, future.result(), None
+        except Exception as e:
+            return f, None, e
+
+
+    def close(self):
+        for _, future in self.queue:
+            future.cancel()
+        self.queue.clear()
+        self.pool.shutdown(wait=True)
+
+
+
+
+# Write files behind in a thread pool, at most depth files at a time.
+# Writes are keyed, e.g. by input file, and their outcome is taken in
+# the order they were put.
+#
+# Usage:
+# writer = WriteBehind(4)
+# writer.put(key, write, path, df)
+# error = writer.wait(key)    # None once written, or the exception
+# writer.close()
+class WriteBehind:
+
+    def __init__(self, depth):
+        self.depth = max(1, depth)
+        self.pool = ThreadPoolExecutor(self.depth)
+        self.futures = {}
+
+
+    def __len__(self):
+        return len(self.futures)
+
+
+    # Queue a write, fn(*args) is called in a writer thread
+    def put(self, key, fn, *args):
+        self.futures[key] = self.pool.submit(fn, *args)
+
+
+    # If the write of key has been queued and not been waited for
+    def pending(self, key):
+        return key in self.futures
+
+
+    # If the write of key is finished, or was never queued
+    def done(self, key):
+        return (key not in self.futures) or self.futures[key].done()
+
+
+    # Wait for the write of key
+    #
+    # Return:
+    # None if it is written or was never queued, or the exception it raised
+    def wait(self, key):
+        future = self.futures.pop(key, None)
+        if future is None:
+            return None
+        return future.exception()
+
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        self.futures.clear()
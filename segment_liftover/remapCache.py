@@ -0,0 +1,312 @@
+import sqlite3
+from segment_liftover.lazy import LazyModule
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+
+
+##########################################################################
+#
+#                   Persistent approximate conversion cache
+#
+##########################################################################
+
+# Approximate conversion results kept in a SQLite file, shared across runs.
+#
+# Each result is keyed by the chain file checksum, the search parameters
+# (mode, step_size, range) and the original position (chro, pos).
+# Results are queried only for the positions a run needs, and written as
+# soon as they are solved.
+class RemapStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        # several processes may read and write at the same time
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS remap (
+                                chain TEXT, mode TEXT, step_size INTEGER, range INTEGER,
+                                chro TEXT, pos INTEGER,
+                                new_chr TEXT, new_pos INTEGER, result TEXT,
+                                PRIMARY KEY (chain, mode, step_size, range, chro, pos)
+                             ) WITHOUT ROWID''')
+        self.conn.commit()
+
+
+    # Look up cached results
+    #
+    # Params:
+    # params: (chain checksum, mode, step_size, range)
+    # chros, positions: the positions to look up
+    #
+    # Return:
+    # a list of (chro, pos, new_chr, new_pos, result)
+    def get(self, params, chros, positions):
+
+        cur = self.conn.cursor()
+        cur.execute('CREATE TEMP TABLE IF NOT EXISTS query (chro TEXT, pos INTEGER)')
+        cur.execute('DELETE FROM query')
+        cur.executemany('INSERT INTO query VALUES (?, ?)',
+                        zip(map(str, chros), map(int, positions)))
+        cur.execute('''SELECT r.chro, r.pos, r.new_chr, r.new_pos, r.result
+                       FROM query q JOIN remap r ON r.chro = q.chro AND r.pos = q.pos
+                       WHERE r.chain = ? AND r.mode = ? AND r.step_size = ? AND r.range = ?''', params)
+        found = cur.fetchall()
+        cur.execute('DELETE FROM query')
+        # end the transaction, so that other processes can write
+        self.conn.commit()
+        return found
+
+
+    # Save new results
+    #
+    # Params:
+    # params: (chain checksum, mode, step_size, range)
+    # entries: a list of (chro, pos, new_chr, new_pos, result)
+    def put(self, params, entries):
+
+        self.conn.executemany('INSERT OR REPLACE INTO remap VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (tuple(params) + (str(e[0]), int(e[1]), str(e[2]), int(e[3]), e[4])
+                               for e in entries))
+        self.conn.commit()
+
+
+    def close(self):
+        self.conn.close()
+
+
+
+
+##########################################################################
+#
+#                   Approximate conversion results of a run
+#
+##########################################################################
+
+# Approximate conversion results held in memory, in NumPy arrays.
+#
+# A position is keyed by an int64, its chromosome code in the upper bits
+# and the position in the lower POS_BITS bits. Every entry holds the new
+# chromosome code, the new position and if the position could be mapped.
+# Entries keep the order they were added in, lookups go through a sorted
+# copy of the keys, so whole arrays of positions are looked up at once.
+#
+# Adds are cheap for large tables: the entry arrays grow by doubling, and
+# the keys of new entries go to a small sorted delta, searched by lookups
+# as well. The delta is merged into the sorted keys once it holds
+# DELTA_SIZE keys.
+#
+# The results are saved as approximate_conversion.log, one line per
+# position: chro_pos, new_chr, new_pos and 'mapped' or 'unmapped'.
+class RemapTable:
+
+    POS_BITS = 40
+    POS_OFFSET = 1 << (POS_BITS - 1)
+    DELTA_SIZE = 1 << 16
+
+    def __init__(self):
+        # chromosome names of both assemblies, the codes are indices
+        self.names = []
+        self.codes = {}
+        # entries, in the order they were added, the first size ones
+        # of the arrays are used
+        self.size = 0
+        self.keys = np.empty(0, dtype=np.int64)
+        self.new_chr = np.empty(0, dtype=np.int32)
+        self.new_pos = np.empty(0, dtype=np.int64)
+        self.mapped = np.empty(0, dtype=bool)
+        # sorted keys, and the entries they belong to
+        self.sorted_keys = np.empty(0, dtype=np.int64)
+        self.sorted_rows = np.empty(0, dtype=np.int64)
+        # sorted keys of the entries added since the last merge
+        self.delta_keys = np.empty(0, dtype=np.int64)
+        self.delta_rows = np.empty(0, dtype=np.int64)
+
+
+    def __len__(self):
+        return self.size
+
+
+    # Make room for n more entries, the arrays double their capacity
+    def reserve(self, n):
+
+        if self.size + n <= len(self.keys):
+            return
+        capacity = max(16, len(self.keys))
+        while capacity < self.size + n:
+            capacity *= 2
+        for name in ['keys', 'new_chr', 'new_pos', 'mapped']:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+
+    # Codes of chromosome names, new names get new codes
+    def chroCodes(self, chros):
+
+        inverse, names = pd.factorize(np.asarray(chros, dtype=object))
+        codes = np.empty(len(names), dtype=np.int32)
+        for i, name in enumerate(names):
+            name = str(name)
+            if name not in self.codes:
+                self.codes[name] = len(self.names)
+                self.names.append(name)
+            codes[i] = self.codes[name]
+        return codes[inverse]
+
+
+    # Keys of positions
+    def encode(self, chros, positions):
+        codes = self.chroCodes(chros).astype(np.int64)
+        return (codes << self.POS_BITS) + np.asarray(positions, dtype=np.int64) + self.POS_OFFSET
+
+
+    # Chromosome names and positions of keys
+    def decode(self, keys):
+        chros = np.array(self.names, dtype=object)[keys >> self.POS_BITS] if len(keys) else np.empty(0, dtype=object)
+        positions = (keys & ((1 << self.POS_BITS) - 1)) - self.POS_OFFSET
+        return chros, positions
+
+
+    # Find the entries of keys
+    #
+    # Return:
+    # an array of entry indices, -1 for keys without an entry
+    def find(self, keys):
+
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        for sorted_keys, sorted_rows in [(self.sorted_keys, self.sorted_rows), (self.delta_keys, self.delta_rows)]:
+            if len(sorted_keys) == 0:
+                continue
+            i = np.searchsorted(sorted_keys, keys)
+            i = np.minimum(i, len(sorted_keys) - 1)
+            hit = sorted_keys[i] == keys
+            rows[hit] = sorted_rows[i[hit]]
+        return rows
+
+
+    # Look up positions
+    #
+    # Return:
+    # found, new chromosome names, new positions and mapped, as arrays.
+    # Positions without an entry are not found, with 'NA' and -1.
+    def get(self, chros, positions):
+
+        rows = self.find(self.encode(chros, positions))
+        found = rows >= 0
+        new_chros = np.full(len(rows), 'NA', dtype=object)
+        new_pos = np.full(len(rows), -1, dtype=np.int64)
+        mapped = np.zeros(len(rows), dtype=bool)
+        if found.any():
+            new_chros[found] = np.array(self.names, dtype=object)[self.new_chr[rows[found]]]
+            new_pos[found] = self.new_pos[rows[found]]
+            mapped[found] = self.mapped[rows[found]]
+        return found, new_chros, new_pos, mapped
+
+
+    # Add results, the ones of positions already in the table replace
+    # the old ones. A position added twice keeps its last result.
+    def add(self, chros, positions, new_chros, new_pos, mapped):
+
+        keys = self.encode(chros, positions)
+        new_codes = self.chroCodes(new_chros) if len(keys) else np.empty(0, dtype=np.int32)
+        new_pos = np.asarray(new_pos, dtype=np.int64)
+        mapped = np.asarray(mapped, dtype=bool)
+
+        # the last result of each key, in the order of their first appearance
+        unique, first = np.unique(keys, return_index=True)
+        _, last = np.unique(keys[::-1], return_index=True)
+        last = len(keys) - 1 - last
+        order = np.argsort(first, kind='stable')
+        unique = unique[order]
+        last = last[order]
+
+        rows = self.find(unique)
+        old = rows >= 0
+        self.new_chr[rows[old]] = new_codes[last[old]]
+        self.new_pos[rows[old]] = new_pos[last[old]]
+        self.mapped[rows[old]] = mapped[last[old]]
+
+        new = ~old
+        count = int(new.sum())
+        if count == 0:
+            return
+        self.reserve(count)
+        new_rows = np.arange(self.size, self.size + count)
+        self.keys[new_rows] = unique[new]
+        self.new_chr[new_rows] = new_codes[last[new]]
+        self.new_pos[new_rows] = new_pos[last[new]]
+        self.mapped[new_rows] = mapped[last[new]]
+        self.size += count
+
+        sort = np.argsort(unique[new])
+        at = np.searchsorted(self.delta_keys, unique[new][sort])
+        self.delta_keys = np.insert(self.delta_keys, at, unique[new][sort])
+        self.delta_rows = np.insert(self.delta_rows, at, new_rows[sort])
+        if len(self.delta_keys) >= self.DELTA_SIZE:
+            self.merge()
+
+
+    # Merge the delta into the sorted keys
+    def merge(self):
+
+        at = np.searchsorted(self.sorted_keys, self.delta_keys)
+        self.sorted_keys = np.insert(self.sorted_keys, at, self.delta_keys)
+        self.sorted_rows = np.insert(self.sorted_rows, at, self.delta_rows)
+        self.delta_keys = np.empty(0, dtype=np.int64)
+        self.delta_rows = np.empty(0, dtype=np.int64)
+
+
+    # All entries, in the order they were added
+    #
+    # Params:
+    # start: skip the first start entries
+    #
+    # Return:
+    # chromosome names, positions, new chromosome names, new positions, mapped
+    def entries(self, start=0):
+
+        chros, positions = self.decode(self.keys[start:self.size])
+        names = np.array(self.names, dtype=object)
+        new_chros = names[self.new_chr[start:self.size]] if len(names) else np.empty(0, dtype=object)
+        return chros, positions, new_chros, self.new_pos[start:self.size], self.mapped[start:self.size]
+
+
+    # A table of the entries added after the first start ones
+    def since(self, start):
+        table = RemapTable()
+        table.add(*self.entries(start))
+        return table
+
+
+    # Add all entries of another table
+    def update(self, other):
+        if len(other) > 0:
+            self.add(*other.entries())
+
+
+    # Read results from an open approximate_conversion.log,
+    # after its header line
+    def read(self, fi):
+
+        chros, positions, new_chros, new_pos, mapped = [], [], [], [], []
+        for line in fi:
+            line = line.strip().split('\t')
+            chro, pos = line[0].rsplit('_', 1)
+            chros.append(chro)
+            positions.append(int(pos))
+            new_chros.append(line[1])
+            new_pos.append(int(line[2]))
+            mapped.append(line[3] == 'mapped')
+        if chros:
+            self.add(np.array(chros, dtype=object), positions, np.array(new_chros, dtype=object), new_pos, mapped)
+
+
+    # Write all entries to an open file, see read()
+    def write(self, fo):
+
+        print('{}\t{}\t{}\t{}'.format('name', 'new_chr', 'new_pos', 'result'), file=fo)
+        for chro, pos, new_chro, new_pos, mapped in zip(*self.entries()):
+            print('{}_{}\t{}\t{}\t{}'.format(chro, pos, new_chro, new_pos, 'mapped' if mapped else 'unmapped'), file=fo)
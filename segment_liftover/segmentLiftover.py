@@ -1,13 +1,35 @@
 import click
+import csv
 import sys
-import pandas as pd
 import math
 import subprocess
 import logging
 import os
 import re
+import time
+import glob
+import shutil
+import json
+import hashlib
+from collections import OrderedDict, deque
+from contextlib import ExitStack
+from functools import partial
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
-from distutils.dir_util import copy_tree
+from segment_liftover.chainIndex import loadChain, chainChecksum, compileChain, compiledChainName, isCompiledChain, findChain, default_chains
+from segment_liftover.liftApi import segmentStatus, LIFTED, REMAPPED, UNMAPPED
+from segment_liftover.remapCache import RemapStore, RemapTable
+from segment_liftover.fileIndex import loadFileIndex, saveFileIndex, scanDirectories
+from segment_liftover.manifest import Manifest, fileFingerprint
+from segment_liftover.checkpoint import AtomicOutput, JournalHandler, readJournal, loadCheckpoint, saveCheckpoint, clearCheckpoint
+from segment_liftover.tableWriter import TableWriter, OUTPUT_FORMATS, formatAvailable, formatFileName
+from segment_liftover.pipeline import ReadAhead, WriteBehind
+from segment_liftover.metrics import Metrics
+from segment_liftover.lazy import LazyModule, preload
+
+# NumPy and pandas are imported when first used, see LazyModule
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
 
 
 
@@ -22,13 +44,28 @@ tmp_dir = '.tmp/'
 log_dir = 'logs/'
 chain_dir = 'chains/'
 examples_dir = 'examples/'
-# assume liftOver is in sys PATH
-liftover_path = 'liftOver'  
+# path of the UCSC liftOver program,
+# None to use the built-in chain engine
+liftover_path = None
 #chain_dir = os.path.abspath('./chains')
 
-# stores remapped positions for fast re-access
-# key = chro_pos, value = [chro, pos, flat=mapped/unmapped]
-remapped_list = {}
+# stores parsed chain files for the built-in engine
+# key = chain path, value = ChainIndex
+chain_indexes = {}
+
+# stores remapped positions for fast re-access, a RemapTable
+remapped_list = None
+
+# persistent store of remapped positions, shared across runs
+remap_store = None
+
+# stores checksums of chain files, key = chain path
+chain_checksums = {}
+
+# stores converted probe positions of array platforms, the most recently
+# used platform_cache_size ones, see liftProbes()
+platform_cache = OrderedDict()
+platform_cache_size = 8
 
 # stores processed files, used for restore progress
 file_list = []
@@ -40,15 +77,60 @@ failed_files = []
 #valid_chro_names.append('chrX')
 #valid_chro_names.append('chrY')
 
+# the method of approximate conversion:
+# 'nearest' finds the closest mappable base in the chain blocks,
+# 'stepwise' samples positions with step_size
+approximate_mode = 'nearest'
+
+# the searching range of the nearest method, in bases
+search_distance = 10000
+
 # the distance to next remapp position
 step_size = 500
 
 # the number positions to search
 steps = 4000
 
+# the most candidates of stepwise approximate conversion converted at a
+# time, which bounds its memory use, see stepwiseMappables()
+max_candidates = 1000000
+
 # global beta
 beta = 2
 
+# the number of rows of probe files to process at a time, 0 for whole files
+chunk_size = 0
+
+# the format of output files, one of OUTPUT_FORMATS
+output_format = 'tsv'
+
+# the positions of batch_size files, up to batch_rows rows, are converted
+# together, see liftFiles()
+batch_size = 1
+batch_rows = 1000000
+
+# converted positions of the current batch of files, a RemapTable
+batch_table = None
+
+# the number of files read ahead and written behind in threads,
+# 0 to read and write every file when it is converted, see pipelineFiles()
+prefetch = 0
+
+# the WriteBehind of pipelineFiles(), None to write outputs right away
+output_writer = None
+
+# time per stage, cache hits and per file stats, see Metrics
+metrics = Metrics()
+
+# the cProfile.Profile of file conversions with --profile, otherwise None
+profiler = None
+
+# the file a worker process saves its profile to, see liftWorker()
+worker_profile = None
+
+# sync the progress journal to disk every progress_sync files
+progress_sync = 100
+
 # if the header line is written
 unmapped_logger_header = False
 
@@ -86,117 +168,314 @@ unmapped_pro = 0
 #
 ##########################################################################
 
+# Get the index of a chain file for the built-in engine,
+# the chain file is parsed only once.
+# A tuple of chain files is composed into one index.
+def getChainIndex(chain):
+    if chain not in chain_indexes:
+        chain_indexes[chain] = loadChain(chain)
+    return chain_indexes[chain]
+
+
+
+
+# Copy the files of a directory tree into another directory,
+# which may exist already. Files of the same name are replaced,
+# file modes are not copied.
+def copyFiles(src, dst):
+    for root, _, files in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(target, exist_ok=True)
+        for name in files:
+            shutil.copyfile(os.path.join(root, name), os.path.join(target, name))
+
+
+
+
+# Exit if the UCSC liftOver program given with -l cannot be run.
+# Only the file is checked, the program is not started, and only
+# by runs converting files, not by e.g. --help or -f.
+def checkLiftOver(path):
+    if shutil.which(path) is None:
+        sys.exit('UCSC liftover program is not properly configurated: {} is not found or not executable'.format(path))
+
+
+
+
+# Convert 1-base regions, either with the built-in chain engine
+# or with the UCSC liftOver program.
+#
+# Params:
+# bed: a DataFrame of regions, columns are chr, start, end and name
+# chain: path of the chain file, or a tuple of chain files, see getChainIndex()
+# label: name of the temp files used by liftOver
+#
+# Return:
+# a DataFrame of converted regions, with the same columns as bed
+# a DataFrame of unconverted regions, columns are chro, start, end, name
+def liftBed(bed, chain, label):
+
+    # single bases already converted with the current batch of files
+    if (batch_table is not None) and (bed.iloc[:,2].values == bed.iloc[:,1].values + 1).all():
+        found, new_chros, new_pos, mapped = batch_table.get(bed.iloc[:,0].values, bed.iloc[:,1].values)
+        if found.all():
+            metrics.count('batch_hits', len(found))
+            return splitBed(bed, new_chros, new_pos, mapped)
+
+    if liftover_path:
+        fin = os.path.join(tmp_dir, label + '.bed')
+        fo = os.path.join(tmp_dir, label + '_new.bed')
+        funmapped = os.path.join(tmp_dir, label + '.unmapped')
+        with metrics.stage('bed'):
+            bed.to_csv(fin, sep=' ', index=False, header=False)
+
+        with metrics.stage('liftover'):
+            cmd = [liftover_path, fin, chain, fo, funmapped]
+            return_info = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if return_info.returncode != 0 :
+                logging.getLogger('liftover').error('sh: %s', cmd)
+                raise RuntimeError(cmd)
+
+            if os.path.getsize(fo) > 0:
+                lifted = pd.read_table(fo, sep='\t', names=bed.columns)
+            else:
+                lifted = bed.iloc[:0]
+            if os.path.getsize(funmapped) > 0:
+                unmapped = pd.read_table(funmapped, sep='\t', comment='#', header=None,
+                                         names=['chro','start','end','name'])
+            else:
+                unmapped = pd.DataFrame(columns=['chro','start','end','name'])
+        return lifted, unmapped
+
+    with metrics.stage('liftover'):
+        index = getChainIndex(chain)
+        new_chros, new_pos, mapped = index.lift(bed.iloc[:,0].values, bed.iloc[:,1].values)
+        return splitBed(bed, new_chros, new_pos, mapped)
+
+
+
+
+# Split converted single bases into the results of liftBed()
+#
+# Params:
+# bed: see liftBed()
+# new_chros, new_pos, mapped: the conversion of the first base of every region
+def splitBed(bed, new_chros, new_pos, mapped):
+
+    lifted = pd.DataFrame({bed.columns[0]: new_chros[mapped],
+                           bed.columns[1]: new_pos[mapped],
+                           bed.columns[2]: new_pos[mapped] + 1,
+                           bed.columns[3]: bed.iloc[:,3].values[mapped]})
+    unmapped = bed[~mapped].rename(columns=dict(zip(bed.columns, ['chro','start','end','name'])))
+    return lifted, unmapped
+
+
+
+
+# Search the nearest mappable positions in the blocks of the chain file
+#
+# Params:
+# df: unconverted positions, columns are chro, start, end, name
+# chain: path of the chain file
+#
+# Return:
+# arrays of new_chr, new_pos and flag ('mapped' or 'unmapped'), one per row of df
+def nearestMappables(df, chain):
+
+    logger = logging.getLogger('liftover')
+    index = getChainIndex(chain)
+    new_chros, new_starts, found = index.nearest(df.chro.values, df.start.values, search_distance)
+    for row in df[~found].itertuples(index=False):
+        logger.warning('Failed to convert (new): ' + str([row.chro, row.start, row.name]))
+    flags = np.where(found, 'mapped', 'unmapped').astype(object)
+    return new_chros, new_starts, flags
+
+
+
+
+# Search mappable positions by stepwise sampling.
+# Positions are searched in slices of at most max_candidates candidates,
+# at least one position at a time, see stepwiseSlice().
+#
+# Params:
+# df: unconverted positions, columns are chro, start, end, name
+# chain: path of the chain file
+#
+# Use global params:
+# steps, step_size, max_candidates
+#
+# Return:
+# arrays of new_chr, new_pos and flag, one per row of df,
+# flag is None for results which should not be cached
+def stepwiseMappables(df, chain):
+
+    size = max(1, max_candidates // max(1, 2 * (steps - 1)))
+    if df.shape[0] <= size:
+        return stepwiseSlice(df, chain)
+    results = [stepwiseSlice(df.iloc[i:i + size], chain) for i in range(0, df.shape[0], size)]
+    return tuple(np.concatenate(arrays) for arrays in zip(*results))
+
+
+
+
+# Search mappable positions of a slice of stepwiseMappables().
+# The candidates of all positions are converted in one batch, each candidate
+# is named by position_index * candidates_per_position + candidate_rank.
+def stepwiseSlice(df, chain):
+
+    logger = logging.getLogger('liftover')
+    num_pos = df.shape[0]
+    num_cand = 2 * (steps - 1)
+
+    # candidates in the order +1, -1, +2, -2 ... steps
+    shifts = np.repeat(np.arange(1, steps), 2) * step_size * np.tile([1, -1], steps - 1)
+    starts = np.repeat(df.start.values, num_cand) + np.tile(shifts, num_pos)
+    candidates = pd.DataFrame({'chr': np.repeat(df.chro.values, num_cand),
+                               'start': starts,
+                               'end': starts + 1,
+                               'name': np.arange(num_pos * num_cand)})
+
+    new_chros = np.full(num_pos, 'NA', dtype=object)
+    new_starts = np.full(num_pos, -1, dtype=np.int64)
+    flags = np.full(num_pos, None, dtype=object)
+
+    try:
+        lifted, _ = liftBed(candidates, chain, 'remap')
+    except RuntimeError:
+        for row in df.itertuples(index=False):
+            logger.warning('Approximate conversion failed, cmd error: ' + str([row.chro, row.start, row.name]))
+        lifted = None
+
+    if lifted is not None:
+        lifted = lifted.sort_values('name', kind='mergesort')
+        lifted['pos_index'] = lifted.name.values // num_cand
+
+        # positions without any mappable candidate
+        missed = np.ones(num_pos, dtype=bool)
+        missed[lifted.pos_index.values] = False
+        flags[missed] = 'unmapped'
+        for row in df[missed].itertuples(index=False):
+            logger.warning('Failed to convert (new): ' + str([row.chro, row.start, row.name]))
+
+        # the first converted candidate of each position is skipped,
+        # without a result on the same chromosome, the last one is kept
+        hits = lifted[lifted.groupby('pos_index').cumcount() > 0]
+        last = hits.drop_duplicates('pos_index', keep='last')
+        new_chros[last.pos_index.values] = last.chr.values
+        new_starts[last.pos_index.values] = last.start.values
+
+        # use the first result on the same chromosome
+        same = hits[hits.chr.values == df.chro.values[hits.pos_index.values]]
+        first = same.drop_duplicates('pos_index', keep='first')
+        new_chros[first.pos_index.values] = first.chr.values
+        new_starts[first.pos_index.values] = first.start.values
+        flags[first.pos_index.values] = 'mapped'
+
+    return new_chros, new_starts, flags
+
+
+
+
+# Key of the current approximate conversion settings in the remap_store
+#
+# Return:
+# (chain checksum, approximate_mode, step_size, range)
+def remapStoreParams(chain):
+
+    if chain not in chain_checksums:
+        chain_checksums[chain] = chainChecksum(chain)
+    if approximate_mode == 'nearest':
+        return (chain_checksums[chain], approximate_mode, 0, search_distance)
+    return (chain_checksums[chain], approximate_mode, step_size, steps*step_size)
+
+
+
+
 # Map the unmapped positions to their nearest mappable positions
 #
 # Param:
-# fin: path of the unmapped file generated by liftover
-# chain: path of the chain file, should be same as used by liftover
-# remap: the remapped_list
+# df: the unconverted regions returned by liftBed
+# chain: path of the chain file, should be same as used by liftBed
+# remap: the remapped_list, a RemapTable
 #
 # Use global params:
-# steps, step_size 
-# the searching range is 100(bps)/step_stize * steps in both direction.
+# approximate_mode: 'nearest' or 'stepwise'
+# search_distance: the searching range of the nearest mode, in bases
+# steps, step_size: the stepwise mode samples every step_size bases,
+# steps times in both direction.
 #
 # Return:
 # a list of lists with chro, new_pos, name 
 # -1 in exception
 #
 # Note: unmappable positions will be returned with value 0
-def solveUnmappables(fin, chain, remap):
+@metrics.timed('remap')
+def solveUnmappables(df, chain, remap):
     
     try:
         logger = logging.getLogger('liftover')
         
-        # read in unmapped file
-        df = pd.read_table(fin, sep='\t', comment='#', header=None, names=['chro','start','end','name'])
+        df = df.copy()
         df.loc[df.chro == 'chr23', 'chro'] = 'chrX'
         df.loc[df.chro == 'chr24', 'chro'] = 'chrY'
-        # keep new coordinates
-        positions = []
         # number of items
         num_pos = df.shape[0]
-        counter = 0
-#        cmd = [liftover_path, './tmp/remap.bed', chain, './tmp/remap_new.bed', 
-#            './tmp/remap.unmapped']
-        cmd = [liftover_path, os.path.join(tmp_dir, 'remap.bed'), chain, 
-               os.path.join(tmp_dir,'remap_new.bed'), os.path.join(tmp_dir,'remap.unmapped')]
-        
-        
-        # For each unmapped postion,
-        # if it is in the remapped_list, get new position from the list
-        # otherwise, gradually search along both sides of the chromesome,
-        # until a mappable position is found
-        # If nothing is mappable in 20M base range, assume that pos is unmappable.
-        for i in range(num_pos):
-
-            chro = df.iloc[i,0]
-            start = df.iloc[i,1]
-            name = df.iloc[i,3]
-            new_pos = -1
-            new_chro = 'NA'
-            key = '{}_{}'.format(chro, start)
-
-            # use buffered mapping if possible
-            if key in remap:
-                new_chro = remap[key][0]
-                new_pos = remap[key][1]
-                flag = remap[key][2]
-                if flag == 'mapped':
-                    counter += 1
-                else:
-                    logger.warning('Failed to convert (cached): ' + str([chro, start, name]))
-            # do a stepwise mapping
-            else:
-                with open(os.path.join(tmp_dir, 'remap.bed'), 'w') as f:
-                    for i in range(1,steps):
-                        print('{}\t{}\t{}\t{}'.format(chro, start+i*step_size, start+i*step_size+1, name), file=f)
-                        print('{}\t{}\t{}\t{}'.format(chro, start-i*step_size, start-i*step_size+1, name), file=f)
 
-                return_info = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                
-                # check running result
-                if return_info.returncode != 0 :
-                    logger.warning('Approximate conversion failed, cmd error: ' + str([chro, start, name]))
-                elif os.path.getsize(os.path.join(tmp_dir,'remap_new.bed')) == 0 :
-                    logger.warning('Failed to convert (new): ' + str([chro, start, name]))
-                    remap[key] = [new_chro, new_pos, 'unmapped']
-                # use the first mapping result
-                else:
-                    with open(os.path.join(tmp_dir, 'remap_new.bed'), 'r') as f:
-                        next(f)
-                        for line in f:
-                            line = line.split('\t')
-                            if len(line) > 1:
-                                new_chro = line[0]
-                                new_pos = int(line[1])
-                            if new_chro == chro:
-                                remap[key] = [new_chro, new_pos, 'mapped']
-                                counter += 1
-                                break
-
-
-
-
-                        # while True:
-                        #     line = f.readline()
-                        #     line = line.split('\t')
-                        #     if len(line) > 1:
-                        #         new_chro = line[0]
-                        #         new_pos = int(line[1])
-                        #         if new_chro == chro:
-                        #             remap[key] = [new_chro, new_pos, 'mapped']
-                        #             counter += 1
-                        #             break
-
-
-            positions.append([new_chro, new_pos, name])
-            
+        # Positions not in the remapped_list are looked up in the persistent store
+        keys = remap.encode(df.chro.values, df.start.values)
+        missing = remap.find(keys) < 0
+        metrics.count('remap_list_hits', num_pos - missing.sum())
+        _, first = np.unique(keys[missing], return_index=True)
+        todo = df[missing].iloc[np.sort(first)]
+        if (remap_store is not None) and (todo.shape[0] > 0):
+            store_params = remapStoreParams(chain)
+            stored = remap_store.get(store_params, todo.chro, todo.start)
+            metrics.count('remap_store_hits', len(stored))
+            if stored:
+                chros, positions, new_chros, new_starts, results = zip(*stored)
+                remap.add(np.array(chros, dtype=object), positions, np.array(new_chros, dtype=object),
+                          new_starts, [r == 'mapped' for r in results])
+                todo = todo[remap.find(remap.encode(todo.chro.values, todo.start.values)) < 0]
+
+        # The rest are searched all at once,
+        # along both sides of the chromosome in the search range
+        metrics.count('remap_searched', todo.shape[0])
+        if todo.shape[0] == 0:
+            new_chros, new_starts, flags = [np.empty(0, dtype=object)] * 3
+        elif approximate_mode == 'nearest':
+            new_chros, new_starts, flags = nearestMappables(todo, chain)
+        else:
+            new_chros, new_starts, flags = stepwiseMappables(todo, chain)
+        cached = pd.notnull(flags)
+        remap.add(todo.chro.values[cached], todo.start.values[cached], new_chros[cached],
+                  new_starts[cached], flags[cached] == 'mapped')
+        if (remap_store is not None) and (todo.shape[0] > 0):
+            remap_store.put(store_params, zip(todo.chro.values[cached], todo.start.values[cached],
+                                              new_chros[cached], new_starts[cached], flags[cached]))
+
+        # keep new coordinates, results which are not cached are taken
+        # from the search, the others from the remapped_list
+        found, new_chr, new_pos, mapped = remap.get(df.chro.values, df.start.values)
+        todo_keys = remap.encode(todo.chro.values, todo.start.values)
+        solved = np.isin(keys, todo_keys)
+        if not found.all():
+            sort = np.argsort(todo_keys)
+            rows = sort[np.searchsorted(todo_keys, keys[~found], sorter=sort)]
+            new_chr[~found] = new_chros[rows]
+            new_pos[~found] = new_starts[rows]
+
+        # use buffered mapping
+        for row in df[~solved & ~mapped].itertuples(index=False):
+            logger.warning('Failed to convert (cached): ' + str([row.chro, row.start, row.name]))
+        counter = int(mapped.sum())
+
+        positions = [list(p) for p in zip(new_chr, new_pos.tolist(), df.name.values)]
         logger.info('Approximate conversion: %i/%i positions.', counter, num_pos)
         return positions
     
     
     except Exception as e:
-        logger.exception('Failure in approximate conversion: %s', fin)
+        logger.exception('Failure in approximate conversion: %i positions', df.shape[0])
         return -1
 
 
@@ -213,6 +492,107 @@ def solveUnmappables(fin, chain, remap):
 
 
 
+# Key of a probe platform in the platform_cache: a hash of the sorted
+# (chromosome, position) pairs, the chain and the approximate conversion
+# settings.
+#
+# Return:
+# the key, and the order of the sorted positions
+def platformKey(chros, positions, chain, remap_flag):
+
+    codes, names = pd.factorize(chros, sort=True)
+    order = np.lexsort((positions, codes))
+    md5 = hashlib.md5()
+    md5.update(json.dumps([list(remapStoreParams(chain)), remap_flag, 
+                           names.astype(str).tolist()]).encode('utf-8'))
+    md5.update(codes[order].astype(np.int32).tobytes())
+    md5.update(positions[order].astype(np.int64).tobytes())
+    return md5.hexdigest(), order
+
+
+
+
+# Convert probe positions and remap the unmapped ones.
+#
+# Files of the same array platform share their probe positions, the
+# results of a platform are kept in the platform_cache, and reused for
+# every file with the same positions, in any order.
+#
+# Params:
+# df_probes: probe positions, columns are chr, position, pos1 and name
+# chain: path of the chain file, or a tuple of chain files, see getChainIndex()
+# remap: the remapped_list
+# remap_flag: remap the unmapped positions
+#
+# Return:
+# a DataFrame of converted positions and one of remapped positions,
+# columns are chr, position, name, in the order of df_probes.
+# Positions that could not be converted are left out.
+def liftProbes(df_probes, chain, remap, remap_flag):
+
+    positions = df_probes.position.values.astype(np.int64)
+    names = df_probes.name.values
+    key, order = platformKey(df_probes.chr.values, positions, chain, remap_flag)
+
+    if key in platform_cache:
+        platform_cache.move_to_end(key)
+        metrics.count('platform_hits')
+        chro_names, new_codes, new_pos, status = platform_cache[key]
+        logging.getLogger('liftover').info('Platform cache: %i positions.', len(positions))
+
+        # back from sorted to row order
+        rows = np.empty(len(order), dtype=np.int64)
+        rows[order] = np.arange(len(order))
+        new_chr = chro_names[new_codes[rows]]
+        new_pos = new_pos[rows]
+        status = status[rows]
+        parts = []
+        for code in [LIFTED, REMAPPED]:
+            keep = status == code
+            parts.append(pd.DataFrame({'chr': new_chr[keep], 'position': new_pos[keep], 'name': names[keep]}))
+        return parts[0], parts[1]
+
+    metrics.count('platform_misses')
+    probes_new, probes_unmapped = liftBed(df_probes, chain, 'probes')
+    del probes_new['pos1']
+    if (remap_flag == True) and (probes_unmapped.shape[0] >0):
+        probes_remap = solveUnmappables(probes_unmapped, chain, remap)
+        probes_remap = pd.DataFrame(probes_remap, columns=probes_new.columns)
+    else:
+        probes_remap = pd.DataFrame(columns=probes_new.columns)
+
+    # keep the results in sorted order
+    new_chr = np.full(len(positions), 'NA', dtype=object)
+    new_pos = np.full(len(positions), -1, dtype=np.int64)
+    status = np.full(len(positions), UNMAPPED, dtype=np.int8)
+    name_index = pd.Index(names)
+    for code, part in [(LIFTED, probes_new), (REMAPPED, probes_remap)]:
+        rows = name_index.get_indexer(part.name.values)
+        new_chr[rows] = part.chr.values
+        new_pos[rows] = part.position.values
+        status[rows] = code
+    new_codes, chro_names = pd.factorize(new_chr[order])
+    platform_cache[key] = (np.asarray(chro_names, dtype=object), new_codes.astype(np.int32), 
+                           new_pos[order], status[order])
+    if len(platform_cache) > platform_cache_size:
+        platform_cache.popitem(last=False)
+
+    return probes_new, probes_remap
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
 # Convert the genome coordinates in segments.tab to the specified the edition
 # according to the provided chain file.
 #
@@ -220,18 +600,19 @@ def solveUnmappables(fin, chain, remap):
 # fin: the path of the input file
 # chain: the path of the chain file
 # remap: the remapped_list
+# table: the file read by readTable() ahead, None to read it here
 #
 # Return: 
 # 0 or -1
 #
-def convertSegments(fin, fo, chain, remap, remap_flag=True, new_colnames = []):
+def convertSegments(fin, fo, chain, remap, remap_flag=True, new_colnames = [], table=None):
     
     logger = logging.getLogger('liftover')
     logger.info('Processing segment:\t%s', fin)
 
     try:
 
-        df = pd.read_table(fin, sep='\t', low_memory=False, keep_default_na=False)
+        df = table if table is not None else readTable(fin)
 
 
         # save original column name
@@ -257,143 +638,93 @@ def convertSegments(fin, fo, chain, remap, remap_flag=True, new_colnames = []):
         df.start = df.start.astype(int)
         df.stop = df.stop.astype(int)
 
-        #Generate new columns for processing
-        df['name'] = df.index
-        
         # update global counter
         global total_seg
         this_total = df.shape[0]
         total_seg += this_total
 
-        #Create a file of start coordinates
-        df_starts = df.loc[:,['chr','start','stop','name']]
-        df_starts['stop'] = df_starts.start + 1
-        df_starts.to_csv(os.path.join(tmp_dir,'starts.bed'), sep=' ', index=False, header=False)
-
-
-        #Create a file of end coordinates
-        df_ends = df.loc[:,['chr','start','stop','name']]
-        df_ends['start'] = df_ends.stop - 1
-        df_ends.to_csv(os.path.join(tmp_dir, 'ends.bed'), sep=' ', index=False, header=False)
-
-    
-    
-        #Convert the start coordinates
-#        cmd = [liftover_path , './tmp/starts.bed' , chain , './tmp/starts_new.bed' ,
-#            './tmp/starts.unmapped']
-        
-        cmd = [liftover_path , os.path.join(tmp_dir, 'starts.bed'), chain, 
-               os.path.join(tmp_dir, 'starts_new.bed') , os.path.join(tmp_dir, 'starts.unmapped')]
-        
-        return_info = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        if return_info.returncode != 0 :
-            logger.error('sh: %s', cmd)
-            raise RuntimeError(cmd)
-            
-    
-        #Read in the new start positions from a file
-        starts_new = pd.read_table(os.path.join(tmp_dir, 'starts_new.bed'), sep='\t', names=df_starts.columns)
-        del starts_new['stop']
-        # update counter
-#        lifted_start = starts_new.shape[0]
-#        remapped_start = 0
-
-        #Remap unmapped start positions
-        if (remap_flag == True) and (os.path.getsize(os.path.join(tmp_dir, 'starts.unmapped')) >0):
-            starts_remap = solveUnmappables(os.path.join(tmp_dir, 'starts.unmapped'), chain, remap)
-            starts_remap = pd.DataFrame(starts_remap, columns=starts_new.columns)
-            # update counter
-#            remapped_start = starts_remap.shape[0]
-            #Merge start positions
-            starts_new = starts_new.append(starts_remap)
-        else: 
-            starts_remap = pd.DataFrame(columns=starts_new.columns)
-       
-        #Convert the end coordinates
-#        cmd = [liftover_path , './tmp/ends.bed' , chain ,  './tmp/ends_new.bed' ,
-#            './tmp/ends.unmapped' ]
-        cmd = [liftover_path , os.path.join(tmp_dir, 'ends.bed') , chain ,
-               os.path.join(tmp_dir, 'ends_new.bed') , os.path.join(tmp_dir, 'ends.unmapped' )]
-        return_info = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        if return_info.returncode != 0 :
-            logger.error('sh: %s', cmd)
-            raise RuntimeError(cmd)
-    
-        #Read in the new end positions from a file
-        ends_new = pd.read_table(os.path.join(tmp_dir,'ends_new.bed'), sep='\t', names=df_ends.columns)
-        del ends_new['start']
-        # update counter
-#        lifted_end = ends_new.shape[0]
-#        remapped_end = 0
-        #ends_new.rename(columns={'start':'stop'}, inplace=True)
-
-
-        #Remap unmapped end positions
-        if (remap_flag == True) and (os.path.getsize(os.path.join(tmp_dir, 'ends.unmapped')) >0):
-            ends_remap = solveUnmappables(os.path.join(tmp_dir, 'ends.unmapped'), chain, remap)
-            ends_remap = pd.DataFrame(ends_remap, columns=ends_new.columns)
-            # update counter
-#            remapped_end = ends_remap.shape[0]
-            #Merge end positions
-            ends_new = ends_new.append(ends_remap)
-        else:
-            ends_remap = pd.DataFrame(columns=ends_new.columns)
-        
-        
-
-        #Merge new positions with original data 
-        dd = pd.merge(starts_new,ends_new,how='inner', on=['name'], suffixes=['_s', '_e'])
-        
-        # update counter
-        #lifted = lifted_start if lifted_start < lifted_end else lifted_end
-        #remapped = remapped_start if remapped_start > remapped_end else remapped_end
-#        global lifted_seg
-#        #lifted_seg += lifted
-##        unique_lifted = pd.merge(starts_new, ends_new, how='outer', on=['name'])
-#        lifted_seg += dd.shape[0]
+        #Start and last bases of all segments,
+        #row i is the start of segment i, row this_total+i is its last base.
+        #Samples of a file often share breakpoints, every distinct base is
+        #converted once, and unique_rows maps the rows to the distinct bases.
+        chros = df.chr.values
+        starts = df.start.values
+        stops = df.stop.values
+        unique_rows, unique_pos = pd.factorize(pd.MultiIndex.from_arrays(
+            [np.concatenate([chros, chros]), np.concatenate([starts, stops - 1])]))
+        num_unique = len(unique_pos)
+        df_pos = pd.DataFrame({'chr': unique_pos.get_level_values(0).values,
+                               'start': unique_pos.get_level_values(1).values,
+                               'stop': unique_pos.get_level_values(1).values + 1,
+                               'name': np.arange(num_unique)})
+
+        #Convert the distinct bases together
+        pos_new, pos_unmapped = liftBed(df_pos, chain, 'segments')
+        unique_chr = np.full(num_unique, 'NA', dtype=object)
+        unique_start = np.full(num_unique, -1, dtype=np.int64)
+        unique_stop = np.full(num_unique, -1, dtype=np.int64)
+        unique_found = np.zeros(num_unique, dtype=bool)
+        rows = pos_new.name.values.astype(np.int64)
+        unique_chr[rows] = pos_new.chr.values
+        unique_start[rows] = pos_new.start.values
+        unique_stop[rows] = pos_new.stop.values
+        unique_found[rows] = True
         
-        
-        df_new = pd.merge(dd, df, how='left', on=['name'],suffixes=['_new','_old'])
-        #df_new.drop(['chr', 'name', 'start_old', 'stop_old'], axis=1, inplace=True)
+        #Remap unmapped bases, the end of a remapped segment is not extended
+        unique_remapped = np.zeros(num_unique, dtype=bool)
+        if (remap_flag == True) and (pos_unmapped.shape[0] >0):
+            pos_remap = solveUnmappables(pos_unmapped, chain, remap)
+            if pos_remap == -1:
+                raise RuntimeError('Approximate conversion failed')
+            rows = np.array([r[2] for r in pos_remap], dtype=np.int64)
+            unique_chr[rows] = [r[0] for r in pos_remap]
+            unique_start[rows] = [r[1] for r in pos_remap]
+            unique_stop[rows] = unique_start[rows]
+            unique_remapped[rows] = True
+
+        #Scatter the results back to the start and end of every segment
+        qc_start = time.perf_counter()
+        new_chr = unique_chr[unique_rows]
+        new_pos = np.concatenate([unique_start[unique_rows[:this_total]], 
+                                  unique_stop[unique_rows[this_total:]]])
+        found = unique_found[unique_rows] | unique_remapped[unique_rows]
+        # starts converted by liftOver, their segments are written first
+        start_lifted = unique_found[unique_rows[:this_total]]
+        remapped_rows = unique_remapped[unique_rows[:this_total]] | unique_remapped[unique_rows[this_total:]]
+
+        #Keep segments with both positions, in the order of liftOver results
+        both = found[:this_total] & found[this_total:]
+        order = np.concatenate([np.flatnonzero(both & start_lifted), np.flatnonzero(both & ~start_lifted)])
+        chr_s = new_chr[order]
+        chr_e = new_chr[order + this_total]
+        start_new = new_pos[order]
+        stop_new = new_pos[order + this_total]
+        df_new = df.iloc[order]
 
-        
-        #Generate new columns for error checking
-        df_new['chr_cmp'] = (df_new.chr_s == df_new.chr_e)
-        df_new['pos_cmpRatio'] = (df_new.stop_new - df_new.start_new) / (df_new.stop_old - df_new.start_old)
-        
         #Check bad liftovers
-        df_mis = df_new[    ((df_new.start_new == -1) | (df_new.stop_new == -1)) |
-                            (df_new.chr_cmp == False) | 
-                            ((df_new.pos_cmpRatio < (1/beta) ) | (df_new.pos_cmpRatio > beta))]
+        status, ratio = segmentStatus(chr_s, start_new, chr_e, stop_new, starts[order], stops[order], beta)
+        bad = status >= UNMAPPED
+        df_mis = pd.DataFrame({'chr': df_new.chr.values[bad], 'start_old': starts[order][bad],
+                               'stop_old': stops[order][bad], 'chr_cmp': (chr_s == chr_e)[bad],
+                               'pos_cmpRatio': ratio[bad]})
 
         # update global counter
-        global remapped_seg, rejected_seg, unmapped_seg, lifted_seg, unmapped_logger_header
-        unmapped = df_mis[(df_mis.start_new == -1) | (df_mis.stop_new == -1)].shape[0]
-#        remapped_seg = remapped_seg + remapped 
+        global remapped_seg, rejected_seg, unmapped_seg, lifted_seg
+        unmapped = int((status == UNMAPPED).sum())
         unmapped_seg += unmapped
         rejected = df_mis.shape[0] - unmapped
         rejected_seg = rejected_seg + rejected
-        if remap_flag == True:
-            uniqe_remapped = pd.merge(starts_remap, ends_remap, how='outer', on=['name'])
-            remapped_seg += uniqe_remapped.shape[0]
-        else:
-            uniqe_remapped = pd.DataFrame()
-        #lifted_seg = lifted_seg + this_total - unmapped - uniqe_remapped.shape[0]
+        remapped_seg += int(remapped_rows.sum())
         lifted_seg = lifted_seg + this_total - unmapped - rejected
-        #Invoke unmapped logger
-        unmapped_logger = logging.getLogger('unmapped')
-        if unmapped_logger_header == False:
-            unmapped_logger.info('{}\t{}\t{}\t{}\t{}\t{}'.format('chromosome','start','end','same_chr/new_chr','length_ratio/new_pos','file'))
-            unmapped_logger_header = True
         #logging unmapped positions
-        for index, row in df_mis.iterrows():
-            unmapped_logger.info('{}\t{}\t{}\t{}\t{:.4f}\t{}'.format(row['chr'],
-                row['start_old'],row['stop_old'],row['chr_cmp'],row['pos_cmpRatio'],fin))
+        logUnmappedHeader()
+        logUnmappedRows(df_mis[['chr', 'start_old', 'stop_old', 'chr_cmp', 'pos_cmpRatio']], fin)
                 
         
-        #Rename and rearrange columns back to the original order
-        df_new = df_new[~df_new.name.isin(df_mis.name)]
-        df_new.rename(columns={'start_new':'start', 'stop_new':'stop'}, inplace=True)
+        #Rearrange columns back to the original order
+        df_new = df_new[~bad].copy()
+        df_new['start'] = start_new[~bad]
+        df_new['stop'] = stop_new[~bad]
         df_new = df_new[col_names]
         
         #restore column names
@@ -402,15 +733,12 @@ def convertSegments(fin, fo, chain, remap, remap_flag=True, new_colnames = []):
                                    'start':new_colnames[2], 'stop':new_colnames[3]}, inplace=True)
         else:
             df_new.columns = original_colnames
+        metrics.add('qc', time.perf_counter() - qc_start)
             
         
-        os.makedirs(os.path.dirname(fo), exist_ok=True)
         # print(fo)
         #df_new.to_csv(fo, sep='\t', index=False, float_format='%.4f') 
-        df_new.to_csv(fo, sep='\t', index=False)         
-        logger.info('Finished\n')
-        progress_logger = logging.getLogger('progress')
-        progress_logger.info(fin)
+        writeOutput(fin, fo, [df_new])
         return 0
     
     except Exception as e:
@@ -433,6 +761,96 @@ def convertSegments(fin, fo, chain, remap, remap_flag=True, new_colnames = []):
 
 
 
+# Time the reading of the chunks of a file, see convertProbes()
+def timedChunks(chunks):
+    chunks = iter(chunks)
+    while True:
+        with metrics.stage('read'):
+            df = next(chunks, None)
+        if df is None:
+            return
+        yield df
+
+
+
+
+# Column types of a table as pandas infers them from the whole file,
+# found chunk by chunk with bounded memory.
+#
+# Params:
+# fin: the path of the input file
+#
+# Return:
+# a dict, key = column name, value = dtype, str for text columns
+@metrics.timed('read')
+def tableDtypes(fin):
+
+    dtypes = {}
+    for df in pd.read_table(fin, sep='\t', keep_default_na=False, chunksize=chunk_size):
+        for col, dtype in df.dtypes.items():
+            if col not in dtypes:
+                dtypes[col] = dtype
+            elif dtypes[col] != dtype:
+                # int and float columns are read as float
+                if (dtypes[col].kind in 'iuf') and (dtype.kind in 'iuf'):
+                    dtypes[col] = np.result_type(dtypes[col], dtype)
+                else:
+                    dtypes[col] = np.dtype(object)
+    return {col: (str if dtype == object else dtype) for col, dtype in dtypes.items()}
+
+
+
+
+
+
+
+
+# Read a whole input file
+@metrics.timed('read')
+def readTable(fin):
+    return pd.read_table(fin, sep='\t', low_memory=False, keep_default_na=False)
+
+
+
+
+# Write the converted parts of a file to its output, in order
+#
+# Params:
+# fo: the output path
+# parts: DataFrames of the same columns
+# float_format: see TableWriter
+@metrics.timed('write')
+def writeTables(fo, parts, float_format=None):
+    with AtomicOutput(fo, binary=(output_format != 'tsv')) as out:
+        writer = TableWriter(out, output_format, float_format=float_format)
+        for df in parts:
+            writer.write(df)
+        writer.close()
+
+
+
+
+# Write the output of a converted file, then log the file as finished.
+# With an output_writer, the output is queued to be written in the
+# background, and the file is logged when it is written, see pipelineFiles().
+def writeOutput(fin, fo, parts, float_format=None):
+    if output_writer is not None:
+        output_writer.put(fin, metrics.inFile, fin, writeTables, fo, parts, float_format)
+    else:
+        writeTables(fo, parts, float_format)
+        finishFile(fin)
+
+
+
+
+# Log a file as finished, in the general log and the progress journal
+def finishFile(fin):
+    logging.getLogger('liftover').info('Finished\n')
+    logging.getLogger('progress').info(fin)
+
+
+
+
 # Convert the genome coordinates in CNprobes.tab to the specified the edition
 # according to the provided chain file.
 #
@@ -440,11 +858,17 @@ def convertSegments(fin, fo, chain, remap, remap_flag=True, new_colnames = []):
 # fin: the path of the input file
 # chain: the path of the chain file
 # remap: the remapped_list
+# table: the file read by readTable() ahead, None to read it here,
+#        not used when the file is streamed in chunks
+#
+# Use global params:
+# chunk_size: when > 0, the file is streamed in chunks of chunk_size rows
+# output_format: the format of the output file
 #
 # Return: 
 # 0 or -1
 #
-def convertProbes(fin, fo, chain, remap, remap_flag=True, new_colnames=[]):
+def convertProbes(fin, fo, chain, remap, remap_flag=True, new_colnames=[], table=None):
     
     logger = logging.getLogger('liftover')
     logger.info('Processing probe:\t%s', fin)
@@ -465,120 +889,131 @@ def convertProbes(fin, fo, chain, remap, remap_flag=True, new_colnames=[]):
         #df = pd.read_table(fin, sep='\t', header=0, names=col_names )
         
         
-        df = pd.read_table(fin, sep='\t', low_memory=False, keep_default_na=False)
-        if df.columns.size < 4:
-            df.insert(0, 'probe_id', 'ID_' + df.index.astype(str))
-            #df['probe_id'] = 'ID_' + df.index.astype(str)
-
-        # save original column name
-        original_colnames = df.columns.values.tolist()        
-        
-        df.rename(columns={df.columns[0]:'probe_id', df.columns[1]:'chromosome',
-                           df.columns[2]:'position'}, inplace=True)        
-        
-        #Save column names for later restore.
-        col_names = df.columns
-        
-        
-        #Drop NA
-        df = df.dropna(axis=0, how='any', subset=['chromosome', 'position'])
-        chro_name = str( df.loc[0,'chromosome'] )
-        if 'chr' not in chro_name:
-            df['chr'] = 'chr' + df['chromosome'].astype(str)        
+        # Read the whole file, or stream it in chunks of chunk_size rows.
+        # Chunks are read with the column types of the whole file.
+        if chunk_size > 0:
+            chunks = timedChunks(pd.read_table(fin, sep='\t', keep_default_na=False, 
+                                               dtype=tableDtypes(fin), chunksize=chunk_size))
         else:
-            df['chr'] = df['chromosome'].astype(str)
+            chunks = [table if table is not None else readTable(fin)]
+
+        add_chr = None
+        # approximately converted probes are written after all the others
+        remapped_parts = []
+
+        # chunks are written as they are converted,
+        # a whole file once it is converted, see writeOutput()
+        parts = []
+        with ExitStack() as stack:
+            if chunk_size > 0:
+                out = stack.enter_context(AtomicOutput(fo, binary=(output_format != 'tsv')))
+                writer = TableWriter(out, output_format, float_format='%.4f')
+                write = metrics.timed('write')(writer.write)
+            else:
+                write = parts.append
+            for df in chunks:
+                if df.columns.size < 4:
+                    df.insert(0, 'probe_id', 'ID_' + df.index.astype(str))
+                    #df['probe_id'] = 'ID_' + df.index.astype(str)
+
+                # save original column name
+                original_colnames = df.columns.values.tolist()        
+            
+                df.rename(columns={df.columns[0]:'probe_id', df.columns[1]:'chromosome',
+                                   df.columns[2]:'position'}, inplace=True)        
+            
+                #Save column names for later restore.
+                col_names = df.columns
+            
+            
+                #Drop NA
+                df = df.dropna(axis=0, how='any', subset=['chromosome', 'position'])
+                if add_chr is None:
+                    chro_name = str( df.loc[0,'chromosome'] )
+                    add_chr = 'chr' not in chro_name
+                if add_chr:
+                    df['chr'] = 'chr' + df['chromosome'].astype(str)        
+                else:
+                    df['chr'] = df['chromosome'].astype(str)
 
 
-        #Force positions to be integer
-        df.position = df.position.astype(int)
+                #Force positions to be integer
+                df.position = df.position.astype(int)
 
-        #Generate new columns for processing
-        df['name'] = df.index
+                #Generate new columns for processing
+                df['name'] = df.index
 
-        #Filter chromosome names
-        
-        # update counter
-        global total_pro
-        total_pro += df.shape[0]
+                #Filter chromosome names
+            
+                # update counter
+                global total_pro
+                total_pro += df.shape[0]
 
-        #Create a file of probe coordinates
-        df_probes = df.loc[:,['chr','position']]
-        df_probes['pos1'] = df_probes.position + 1
-        df_probes['name'] = df_probes.index
-        df_probes.to_csv(os.path.join(tmp_dir, 'probes.bed'), sep=' ', index=False, header=False)
+                #Create probe coordinates
+                df_probes = df.loc[:,['chr','position']]
+                df_probes['pos1'] = df_probes.position + 1
+                df_probes['name'] = df_probes.index
 
-    
-        #Convert the probe coordinates
-        cmd = [liftover_path , os.path.join(tmp_dir,'probes.bed') , chain ,
-               os.path.join(tmp_dir,'probes_new.bed') , os.path.join(tmp_dir, 'probes.unmapped')]
-        return_info = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        if return_info.returncode != 0 :
-            logger.error('sh: %s', cmd)
-            raise RuntimeError(cmd)
-            
-    
-        #Read in the new probe positions from a file
-        probes_new = pd.read_table(os.path.join(tmp_dir,'probes_new.bed'), sep='\t', names=df_probes.columns)
-        del probes_new['pos1']
-        # update counter
-        global lifted_pro
-        lifted_pro += probes_new[probes_new.position !=-1].shape[0]
-        remapped = 0
-
-
-        #Remap the unmapped
-        if (remap_flag == True) and (os.path.getsize(os.path.join(tmp_dir,'probes.unmapped')) >0):
-            probes_remap = solveUnmappables(os.path.join(tmp_dir,'probes.unmapped'), chain, remap)
-            probes_remap = pd.DataFrame(probes_remap, columns=probes_new.columns)
-            # update counter
-            remapped = probes_remap.shape[0]
-            #Merage new positions
-            probes_new = probes_new.append(probes_remap)
-        
-        #Merge and rearrange the coloumns to the original format
-        df_new = pd.merge(probes_new, df, how='left', on=['name'],suffixes=['_new','_old'])
-        
-        #Check if new and old positions are on the chromosome
-        df_new['chr_cmp'] = (df_new.chr_new == df_new.chr_old)        
-        #Check if the new position is unmappable
-        #Merge all unmapped positions
-        df_mis = df_new[ (df_new.chr_cmp == False) | (df_new.position_new == -1)]
-        
-        # update global counter
-        global remapped_pro, rejected_pro, unmapped_pro, unmapped_logger_header
-        unmapped = df_mis[df_mis.position_new == -1].shape[0]
-        unmapped_pro += unmapped
-        remapped_pro = remapped_pro + remapped - unmapped
-        rejected_pro = rejected_pro + df_mis.shape[0] - unmapped
-
-        #Invoke unmapped logger
-        unmapped_logger = logging.getLogger('unmapped')
-        if unmapped_logger_header == False:
-            unmapped_logger.info('{}\t{}\t{}\t{}\t{}\t{}'.format('chromosome','start','end','same_chr/new_chr','length_ratio/new_pos','file'))        
-            unmapped_logger_header = True
-        #logging unmapped positions
-        for index, row in df_mis.iterrows():
-            unmapped_logger.info('{}\t{}\t{}\t{}\t{}\t{}'.format( row['chr_old'],
-                row['position_old'], '-1', row['chr_new'], row['position_new'], fin))
-        
         
-        df_new = df_new[~df_new.name.isin(df_mis.name)]
-        df_new.rename(columns={'position_new':'position'}, inplace=True)
-        df_new = df_new[col_names]
+                #Convert the probe coordinates, and remap the unmapped
+                probes_new, probes_remap = liftProbes(df_probes, chain, remap, remap_flag)
+                # update counter
+                global lifted_pro
+                lifted_pro += probes_new[probes_new.position !=-1].shape[0]
+                remapped = probes_remap.shape[0]
+
+                #Merage new positions
+                qc_start = time.perf_counter()
+                if remapped > 0:
+                    probes_new = probes_new.append(probes_remap)
+            
+                #Merge and rearrange the coloumns to the original format
+                df_new = pd.merge(probes_new, df, how='left', on=['name'],suffixes=['_new','_old'])
+            
+                #Check if new and old positions are on the chromosome
+                df_new['chr_cmp'] = (df_new.chr_new == df_new.chr_old)        
+                #Check if the new position is unmappable
+                #Merge all unmapped positions
+                df_mis = df_new[ (df_new.chr_cmp == False) | (df_new.position_new == -1)]
+            
+                # update global counter
+                global remapped_pro, rejected_pro, unmapped_pro
+                unmapped = df_mis[df_mis.position_new == -1].shape[0]
+                unmapped_pro += unmapped
+                remapped_pro = remapped_pro + remapped - unmapped
+                rejected_pro = rejected_pro + df_mis.shape[0] - unmapped
+
+                #logging unmapped positions
+                logUnmappedHeader()
+                logUnmappedRows(df_mis[['chr_old', 'position_old']].assign(end='-1')
+                                .join(df_mis[['chr_new', 'position_new']]), fin)
+            
+            
+                df_new = df_new[~df_new.name.isin(df_mis.name)]
+                is_remapped = df_new.name.isin(probes_remap.name)
+                df_new.rename(columns={'position_new':'position'}, inplace=True)
+                df_new = df_new[col_names]
+            
+                #restore column names
+                if len(new_colnames) > 0:
+                    df_new.rename(columns={'probe_id':new_colnames[0], 'chromosome':new_colnames[1],
+                                           'position':new_colnames[2]}, inplace=True)
+                else:
+                    df_new.columns = original_colnames
+                metrics.add('qc', time.perf_counter() - qc_start)
+            
+                remapped_parts.append(df_new[is_remapped])
+                write(df_new[~is_remapped])
+
+            write(pd.concat(remapped_parts))
+            if chunk_size > 0:
+                with metrics.stage('write'):
+                    writer.close()
         
-        #restore column names
-        if len(new_colnames) > 0:
-            df_new.rename(columns={'probe_id':new_colnames[0], 'chromosome':new_colnames[1],
-                                   'position':new_colnames[2]}, inplace=True)
+        if chunk_size > 0:
+            finishFile(fin)
         else:
-            df_new.columns = original_colnames
-        
-        os.makedirs(os.path.dirname(fo), exist_ok=True)
-        df_new.to_csv(fo, sep='\t', index=False, float_format='%.4f') 
-        
-        logger.info('Finished\n')
-        progress_logger = logging.getLogger('progress')
-        progress_logger.info(fin)
+            writeOutput(fin, fo, parts, float_format='%.4f')
         return 0
     
     except Exception as e:
@@ -593,6 +1028,442 @@ def convertProbes(fin, fo, chain, remap, remap_flag=True, new_colnames=[]):
 
 
 
+##########################################################################
+#
+#                   File processing
+#
+##########################################################################
+
+# Convert one indexed file, as segment or probe file according to its name
+#
+# Params:
+# f: path of the input file
+# options: a dict of cli options, keys are input_dir, output_dir, chain_file,
+#          seg_pattern, pro_pattern, segment_output_file, probe_output_file,
+#          remap_flag, new_segment_header, new_probe_header
+# remap: the remapped_list
+# table: the file read ahead, see convertSegments() and convertProbes()
+#
+# Return:
+# file type ('segment', 'probe' or None) and 0 or -1
+#
+# The time, rows and stages of the file are recorded in the metrics.
+def liftFile(f, options, remap, table=None):
+
+    kind, out_path = outputPath(f, options)
+    start = time.perf_counter()
+    before = metrics.snapshot(f)
+    rows = total_seg + total_pro
+    if profiler is not None:
+        profiler.enable()
+
+    # lift over
+    with metrics.file(f):
+        if kind == 'segment':
+            code = convertSegments(f, out_path, options['chain_file'], remap, 
+                                   options['remap_flag'], options['new_segment_header'], table)
+
+        elif kind == 'probe':
+            code = convertProbes(f, out_path, options['chain_file'], remap, 
+                                 options['remap_flag'], options['new_probe_header'], table)
+
+        else:
+            print('Unknown file type: ' + f)
+            logging.getLogger('liftover').error('Unknown file type: ' + f)
+            code = -1
+
+    if profiler is not None:
+        profiler.disable()
+    metrics.addFile(f, kind, code, total_seg + total_pro - rows, time.perf_counter() - start, before)
+    return kind, code
+
+
+
+
+# The bases of a file converted by convertSegments() or convertProbes(),
+# read the same way: the start and last base of every segment, or the
+# position of every probe.
+#
+# With chunk_size, probe files are read as convertProbes() reads them,
+# in chunks of chunk_size rows. Files of more than one chunk are left out
+# of the batch, convertProbes() streams them on their own.
+#
+# Params:
+# f: the input file
+# kind: 'segment' or 'probe'
+#
+# Return:
+# arrays of chromosome names and positions,
+# or None for probe files of more than one chunk
+@metrics.timed('read')
+def filePositions(f, kind):
+
+    if (kind == 'probe') and (chunk_size > 0):
+        chunks = pd.read_table(f, sep='\t', low_memory=False, keep_default_na=False, chunksize=chunk_size)
+        df = next(chunks, None)
+        if (df is None) or (next(chunks, None) is not None):
+            chunks.close()
+            return None
+    else:
+        df = pd.read_table(f, sep='\t', low_memory=False, keep_default_na=False)
+    if kind == 'segment':
+        df = df.dropna(axis=0, how='any', subset=df.columns[1:4].tolist())
+        chros = df.iloc[:,1]
+        positions = [df.iloc[:,2].astype(int).values, df.iloc[:,3].astype(int).values - 1]
+    else:
+        if df.columns.size < 4:
+            df.insert(0, 'probe_id', 'ID_' + df.index.astype(str))
+        df = df.dropna(axis=0, how='any', subset=df.columns[1:3].tolist())
+        chros = df.iloc[:,1]
+        positions = [df.iloc[:,2].astype(int).values]
+
+    if 'chr' not in str(chros.loc[0]):
+        chros = 'chr' + chros.astype(str)
+    else:
+        chros = chros.astype(str)
+    chros = chros.values
+    return np.concatenate([chros] * len(positions)), np.concatenate(positions)
+
+
+
+
+# Convert the positions of a batch of files together, the results are
+# kept in batch_table, where liftBed() finds them when the files are
+# converted one by one. Unconverted positions are approximately
+# converted too, into the remapped_list.
+#
+# Files are read in order until batch_rows rows, at least one file is
+# read. Files which cannot be read, and probe files larger than
+# chunk_size rows, are left to liftFile().
+#
+# Params:
+# files: the input files of the batch
+# options, remap: see liftFile()
+#
+# Return:
+# the number of files in the batch
+def preliftFiles(files, options, remap):
+
+    global batch_table
+    batch_table = None
+    chros = []
+    positions = []
+    rows = 0
+    count = 0
+    for f in files:
+        if (count > 0) and (rows >= batch_rows):
+            break
+        count += 1
+        kind, _ = outputPath(f, options)
+        if kind is None:
+            continue
+        try:
+            found = metrics.inFile(f, filePositions, f, kind)
+        except Exception:
+            continue
+        if found is None:
+            continue
+        file_chros, file_positions = found
+        chros.append(file_chros)
+        positions.append(file_positions)
+        rows += len(file_positions)
+
+    if rows == 0:
+        return count
+
+    # every distinct base once, in the order of their first appearance
+    _, unique_pos = pd.factorize(pd.MultiIndex.from_arrays([np.concatenate(chros), np.concatenate(positions)]))
+    bed = pd.DataFrame({'chr': unique_pos.get_level_values(0).values,
+                        'start': unique_pos.get_level_values(1).values,
+                        'stop': unique_pos.get_level_values(1).values + 1,
+                        'name': np.arange(len(unique_pos))})
+    lifted, unmapped = liftBed(bed, options['chain_file'], 'batch')
+
+    table = RemapTable()
+    rows = lifted.name.values.astype(np.int64)
+    table.add(bed.chr.values[rows], bed.start.values[rows], lifted.chr.values, lifted.start.values,
+              np.ones(len(rows), dtype=bool))
+    table.add(unmapped.chro.values, unmapped.start.values, np.full(unmapped.shape[0], 'NA', dtype=object),
+              np.full(unmapped.shape[0], -1), np.zeros(unmapped.shape[0], dtype=bool))
+
+    if options['remap_flag'] and (unmapped.shape[0] > 0):
+        logging.getLogger('liftover').info('Batch of %i files:\t%i positions to convert approximately.',
+                                           count, unmapped.shape[0])
+        solveUnmappables(unmapped, options['chain_file'], remap)
+
+    batch_table = table
+    return count
+
+
+
+
+# Convert files, the positions of batch_size files at a time together,
+# see preliftFiles()
+#
+# Params:
+# files: the input files
+# options, remap: see liftFile()
+#
+# Return:
+# a generator of the file, its type and 0 or -1, see liftFile()
+def liftFiles(files, options, remap):
+
+    global batch_table
+    if batch_size <= 1:
+        yield from convertFiles(files, options, remap)
+        return
+
+    files = list(files)
+    i = 0
+    while i < len(files):
+        count = preliftFiles(files[i:i + batch_size], options, remap)
+        yield from convertFiles(files[i:i + count], options, remap)
+        batch_table = None
+        i += count
+
+
+
+
+# Convert files one by one, through pipelineFiles() if prefetch > 0
+#
+# Return:
+# a generator of the file, its type and 0 or -1, see liftFile()
+def convertFiles(files, options, remap):
+    if prefetch > 0:
+        return pipelineFiles(files, options, remap)
+    return ((f,) + liftFile(f, options, remap) for f in files)
+
+
+
+
+# Convert files while the next prefetch files are read in threads, and
+# the outputs of the last ones are written in threads, see ReadAhead and
+# WriteBehind. At most prefetch files wait in either stage, which bounds
+# the memory use. Probe files streamed in chunks are not read ahead.
+#
+# Return:
+# a generator of the file, its type and 0 or -1, see liftFile(),
+# in order, every file once its output is written
+def pipelineFiles(files, options, remap):
+
+    global output_writer
+
+    def read(f):
+        kind, _ = outputPath(f, options)
+        if (kind == 'segment') or ((kind == 'probe') and (chunk_size == 0)):
+            return metrics.inFile(f, readTable, f)
+        return None
+
+    output_writer = WriteBehind(prefetch)
+    pending = deque()
+    try:
+        # a file which cannot be read ahead is read again by its converter,
+        # which logs the failure
+        for f, table, error in ReadAhead(files, read, prefetch):
+            pending.append((f,) + liftFile(f, options, remap, table))
+            while pending and ((len(pending) > prefetch) or output_writer.done(pending[0][0])):
+                yield writtenFile(*pending.popleft())
+        while pending:
+            yield writtenFile(*pending.popleft())
+    finally:
+        output_writer.close()
+        output_writer = None
+
+
+
+
+# Wait for the output of a file of pipelineFiles() to be written,
+# then log the file as finished, or as failed if the writing failed
+#
+# Return:
+# the file, its type and 0 or -1
+def writtenFile(f, kind, code):
+
+    queued = output_writer.pending(f)
+    error = output_writer.wait(f)
+    if error is not None:
+        logging.getLogger('liftover').error('Failure in %s: %s', kind, f, exc_info=error)
+        failed_files.append(f)
+        return f, kind, -1
+    if queued:
+        finishFile(f)
+    return f, kind, code
+
+
+
+
+# The type and output path of an input file
+#
+# Params:
+# f: the input file
+# options: see liftFile()
+#
+# Return:
+# 'segment', 'probe' or None, and the output path
+def outputPath(f, options):
+
+    #generate output path
+    rel_path = os.path.relpath(os.path.dirname(f), options['input_dir'])
+    seg_pattern = options['seg_pattern']
+    pro_pattern = options['pro_pattern']
+
+    if (seg_pattern !=None) and (seg_pattern.match(os.path.basename(f))):
+        if options['segment_output_file'] == None:
+            segment_output_file_dynamic = seg_pattern.match(os.path.basename(f)).group(0)
+            return 'segment', os.path.join(options['output_dir'], rel_path, formatFileName(segment_output_file_dynamic, output_format))
+        else:
+            return 'segment', os.path.join(options['output_dir'], rel_path, formatFileName(options['segment_output_file'], output_format))
+
+    elif (pro_pattern !=None) and (pro_pattern.match(os.path.basename(f))):
+        if options['probe_output_file'] == None:
+            probe_output_file_dynamic = pro_pattern.match(os.path.basename(f)).group(0)
+            return 'probe', os.path.join(options['output_dir'], rel_path, formatFileName(probe_output_file_dynamic, output_format))
+        else:
+            return 'probe', os.path.join(options['output_dir'], rel_path, formatFileName(options['probe_output_file'], output_format))
+
+    return None, None
+
+
+
+
+# Write the header line of the unmapped logger, only once
+def logUnmappedHeader():
+    global unmapped_logger_header
+    if unmapped_logger_header == False:
+        logging.getLogger('unmapped').info('{}\t{}\t{}\t{}\t{}\t{}'.format('chromosome','start','end',
+                                           'same_chr/new_chr','length_ratio/new_pos','file'))
+        unmapped_logger_header = True
+
+
+
+
+# Write rows to the unmapped logger in one block, one tab separated line
+# per row with the file name at the end, floats with 4 decimals.
+def logUnmappedRows(df, fin):
+    if df.shape[0] == 0:
+        return
+    block = df.assign(file=fin).to_csv(sep='\t', header=False, index=False, na_rep='nan',
+                                       float_format='%.4f', quoting=csv.QUOTE_NONE, escapechar='\\')
+    # to_csv ends lines with os.linesep, the log handler adds its own
+    logging.getLogger('unmapped').info(block[:-len(os.linesep)].replace(os.linesep, '\n'))
+
+
+
+
+# Return the stat counters and reset them to zero
+def takeCounters():
+    global total_seg, lifted_seg, remapped_seg, rejected_seg, unmapped_seg
+    global total_pro, lifted_pro, remapped_pro, rejected_pro, unmapped_pro
+    counters = [total_seg, lifted_seg, remapped_seg, rejected_seg, unmapped_seg,
+                total_pro, lifted_pro, remapped_pro, rejected_pro, unmapped_pro]
+    total_seg = lifted_seg = remapped_seg = rejected_seg = unmapped_seg = 0
+    total_pro = lifted_pro = remapped_pro = rejected_pro = unmapped_pro = 0
+    return counters
+
+
+
+
+# Add counters returned by takeCounters() to the stat counters
+def addCounters(counters):
+    global total_seg, lifted_seg, remapped_seg, rejected_seg, unmapped_seg
+    global total_pro, lifted_pro, remapped_pro, rejected_pro, unmapped_pro
+    total_seg += counters[0]
+    lifted_seg += counters[1]
+    remapped_seg += counters[2]
+    rejected_seg += counters[3]
+    unmapped_seg += counters[4]
+    total_pro += counters[5]
+    lifted_pro += counters[6]
+    remapped_pro += counters[7]
+    rejected_pro += counters[8]
+    unmapped_pro += counters[9]
+
+
+
+
+# Pass log records of worker processes to the loggers of the main process
+class LogDispatcher(logging.Handler):
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+
+
+# Initialize a worker process of the process pool
+#
+# Params:
+# settings: a dict of the global params of the main process
+# log_queue: the queue read by the LogDispatcher of the main process
+def initWorker(settings, log_queue):
+
+    global tmp_dir, liftover_path, beta, approximate_mode, search_distance, step_size, steps, chunk_size, output_format
+    global batch_size, batch_rows, prefetch
+    global remapped_list, remap_store, unmapped_logger_header, profiler, worker_profile
+
+    # each worker has its own temp files
+    tmp_dir = os.path.join(settings['tmp_dir'], 'worker_{}'.format(os.getpid()))
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    liftover_path = settings['liftover_path']
+    beta = settings['beta']
+    approximate_mode = settings['approximate_mode']
+    search_distance = settings['search_distance']
+    step_size = settings['step_size']
+    steps = settings['steps']
+    chunk_size = settings['chunk_size']
+    output_format = settings['output_format']
+    batch_size = settings['batch_size']
+    batch_rows = settings['batch_rows']
+    prefetch = settings['prefetch']
+    remapped_list = settings['remapped_list']
+    if settings['cache_file']:
+        remap_store = RemapStore(settings['cache_file'])
+    else:
+        remap_store = None
+
+    # stats inherited from the main process are not the worker's
+    metrics.reset()
+    if settings['profile_dir']:
+        import cProfile
+        profiler = cProfile.Profile()
+        worker_profile = os.path.join(settings['profile_dir'], 'profile_worker_{}.pstats'.format(os.getpid()))
+
+    # the header is written by the main process
+    unmapped_logger_header = True
+    for name in ['liftover', 'progress', 'unmapped']:
+        logger = logging.getLogger(name)
+        logger.handlers = [QueueHandler(log_queue)]
+        logger.setLevel(logging.INFO)
+
+
+
+
+# Convert a batch of files in a worker process, see liftFiles()
+#
+# Return:
+# the file, its type and 0 or -1 of every file, the stat counters,
+# failed files, the positions added to the remapped_list and the metrics.
+# With --profile, the profile of the worker so far is saved to worker_profile.
+def liftWorker(files, options):
+
+    takeCounters()
+    start = len(remapped_list)
+    results = list(liftFiles(files, options, remapped_list))
+    new_remapped = remapped_list.since(start)
+    failed = failed_files[:]
+    del failed_files[:]
+    if profiler is not None:
+        profiler.dump_stats(worker_profile)
+    return results, takeCounters(), failed, new_remapped, metrics.take()
+
+
+
+
+
+
+
+
+
 ##########################################################################
 #
 #                   Command line interface
@@ -602,43 +1473,49 @@ def convertProbes(fin, fo, chain, remap, remap_flag=True, new_colnames=[]):
 @click.command()
 @click.option('-i', '--input_dir', help='The directory to start processing.')
 @click.option('-o', '--output_dir', help='The directory to write new files.')
-@click.option('-c', '--chain_file', help='Specify the chain file name.')
+@click.option('-c', '--chain_file', multiple=True, help='Specify the chain file name or a compiled chain index. Repeat to convert through several chains in one pass.')
 @click.option('-si', '--segment_input_file', help='Specify the segment input file name.')
 @click.option('-so', '--segment_output_file', help='Specify the segment output file name.')
 @click.option('-pi', '--probe_input_file', help='Specify the probe input file name.')
 @click.option('-po', '--probe_output_file', help='Specify the probe output file name.')
-@click.option('-l', '--liftover', 'liftover_path_usr', type=str, help='Specify the location of the UCSC liftover program.')
+@click.option('-l', '--liftover', 'liftover_path_usr', type=str, help='Use the UCSC liftover program at this location instead of the built-in chain engine.')
 @click.option('-t', '--test_mode', type=int, help='Only process a limited number of files.')
 @click.option('-f', '--file_indexing', is_flag=True, help='Only generate the index file.')
 @click.option('-x', '--index_file', type=click.File('r'), help='Specify an index file containing file paths.')
 @click.option('-m', '--mapping_file', type=click.File('r'), help='Specify a pre-defined file of position mappings.')
-@click.option('--step_size', 'step_size_usr', default=400, help='The step size of approximate conversion (in bases, default:400).')
+@click.option('--cache_file', type=str, help='Specify a SQLite file to keep approximate conversion results across runs.')
+@click.option('--step_size', 'step_size_usr', default=400, help='The step size of stepwise approximate conversion (in bases, default:400).')
 @click.option('--range', 'search_range', default=10, help='The searching range of approximate conversion (in kilo bases, default:10).')
+@click.option('--approximate_mode', 'approximate_mode_usr', type=click.Choice(['nearest', 'stepwise']), default='nearest', help='The method of approximate conversion: the nearest mappable base, or stepwise sampling with step_size (default:nearest).')
 @click.option('--beta', 'beta_usr', type=click.FLOAT, help='Parameter in quality control.')
 @click.option('--no_approximate_conversion', is_flag=True, help='Do not perform approximate conversion.')
 @click.option('--new_segment_header', nargs=4, type=str, help='Specify 4 new column names for new segment files.' )
 @click.option('--new_probe_header', nargs=3, type=str, help='Specify 3 new column names for new probe files.')
 @click.option('--resume', 'resume_files', nargs=2, type=str, help='Specify a index file and a progress file to resume an interrupted job.')
+@click.option('--no_resume', is_flag=True, help='Start the job from the beginning, even if an interrupted run of the same job is found.')
 @click.option('--demo', help='Copy example files to a user defined direcotry and run a demonstration.')
 @click.option('--log_path', 'log_path_usr',type=str, help='Specify the directory to write logging files.')
+@click.option('--chunk_size', 'chunk_size_usr', default=0, type=click.IntRange(min=0), help='Process probe files in chunks of this number of rows (default:0, whole files).')
+@click.option('--batch_size', 'batch_size_usr', default=1, type=click.IntRange(min=1), help='Convert the positions of this number of files together (default:1, one file at a time).')
+@click.option('--batch_rows', 'batch_rows_usr', default=1000000, type=click.IntRange(min=1), help='The maximum number of rows of a batch of files (default:1000000).')
+@click.option('--prefetch', 'prefetch_usr', default=0, type=click.IntRange(min=0), help='Read this number of files ahead and write outputs in the background, in threads (default:0, no threads).')
+@click.option('--output_format', 'output_format_usr', type=click.Choice(OUTPUT_FORMATS), default='tsv', help='The format of output files, parquet and feather need the pyarrow package (default:tsv).')
+@click.option('--profile', is_flag=True, help='Profile the conversion of files with cProfile, into profile.pstats and profile.txt in the log directory.')
+@click.option('--incremental', is_flag=True, help='Skip files whose outputs are current, from the manifest of previous runs.')
+@click.option('-j', '--jobs', default=1, type=click.IntRange(min=1), help='The number of files to process in parallel (default:1).')
 def cli(input_dir, output_dir, chain_file, test_mode, file_indexing, segment_input_file, segment_output_file, 
         probe_input_file, probe_output_file, step_size_usr, search_range, index_file, mapping_file, no_approximate_conversion,
-        new_segment_header, new_probe_header, resume_files, liftover_path_usr, beta_usr, demo, log_path_usr):
+        new_segment_header, new_probe_header, resume_files, no_resume, liftover_path_usr, beta_usr, demo, log_path_usr,
+        approximate_mode_usr, cache_file, jobs, chunk_size_usr, batch_size_usr, batch_rows_usr, prefetch_usr, output_format_usr, profile, incremental):
 
 
     test_counter = 0
 
     
-    # User defined liftOver 
+    # User defined liftOver, checked before the first file is converted
     if liftover_path_usr:
         global liftover_path
         liftover_path = liftover_path_usr
-        
-    # validate UCSC liftOver program
-    try:
-        subprocess.run(liftover_path,stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    except Exception as e:
-        sys.exit('UCSC liftover program is not properly configurated: {}'.format(e))
 
     # Check beta value:
     global beta
@@ -660,14 +1537,14 @@ def cli(input_dir, output_dir, chain_file, test_mode, file_indexing, segment_inp
 
         # copy files
         examples_path = os.path.join(os.path.dirname(__file__), examples_dir)
-        copy_tree(examples_path, demo_input, preserve_mode=0)
+        copyFiles(examples_path, demo_input)
         if os.path.isdir(demo_input):
             print('Copied examples to {}'.format(demo_input))
         
         # default params
         input_dir = demo_input
         output_dir = os.path.join(os.path.abspath(demo), 'examples', 'outputs')
-        chain_file = 'hg18ToHg38'
+        chain_file = ('hg18ToHg38',)
         segment_input_file = 'segments.tsv'
         segment_output_file = 'segments.tsv'
         probe_input_file = 'probes.tsv'
@@ -689,6 +1566,8 @@ def cli(input_dir, output_dir, chain_file, test_mode, file_indexing, segment_inp
 #        sys.exit('Error: Must specify input and output file names.')
     
     #check input & output file 
+    seg_pattern = None
+    pro_pattern = None
     if (segment_input_file == None) and (probe_input_file == None):
         sys.exit('Error: Must specify at least one input file name: semgent or probe.') 
         
@@ -735,18 +1614,24 @@ def cli(input_dir, output_dir, chain_file, test_mode, file_indexing, segment_inp
             log_dir = log_path_usr        
         
     # produce chain file
-    default_chains = ['hg18ToHg19', 'hg18ToHg38', 'hg19ToHg38','hg38ToHg19','hg19ToHg18']
     if not chain_file:
         sys.exit('Error: please specify a chain file.')
-    elif chain_file in default_chains:
-        chain_file = chain_file + '.over.chain.gz'
-        chain_file = os.path.join(os.path.dirname(__file__), chain_dir, chain_file )
-    if os.path.isfile( chain_file ) == False:
-        sys.exit('Error: chainfile does not exist.')
+    chain_paths = [findChain(c, compiled=(liftover_path is None)) for c in chain_file]
+    if None in chain_paths:
+        sys.exit('Error: chainfile {} does not exist.'.format(chain_file[chain_paths.index(None)]))
+    if liftover_path and any(isCompiledChain(c) for c in chain_paths):
+        sys.exit('Error: the liftOver program can not read a compiled chain index, please use the chain file.')
+    if liftover_path and len(chain_paths) > 1:
+        sys.exit('Error: several chain files can only be composed by the built-in chain engine, please remove -l.')
+    if liftover_path:
+        checkLiftOver(liftover_path)
+    # several chains are composed into one, positions are converted through
+    # all of them in one pass, and approximately converted at the end only
+    chain_file = chain_paths[0] if len(chain_paths) == 1 else tuple(chain_paths)
 
 
     # Assign step value
-    global step_size, steps
+    global step_size, steps, search_distance, approximate_mode
     if step_size_usr > 0 :
         step_size = step_size_usr
     else:
@@ -754,8 +1639,25 @@ def cli(input_dir, output_dir, chain_file, test_mode, file_indexing, segment_inp
         
     if search_range >0 :
         steps = math.ceil(search_range*1000/step_size)
+        search_distance = search_range*1000
     else:
         sys.exit('range must be greater than 0')
+    approximate_mode = approximate_mode_usr
+
+    global chunk_size
+    chunk_size = chunk_size_usr
+
+    global batch_size, batch_rows
+    batch_size = batch_size_usr
+    batch_rows = batch_rows_usr
+
+    global prefetch
+    prefetch = prefetch_usr
+
+    global output_format
+    if not formatAvailable(output_format_usr):
+        sys.exit('Error: output_format {} needs the pyarrow package, please install it.'.format(output_format_usr))
+    output_format = output_format_usr
 
     # convert no_approximate_conversion flg
     remap_flag = not no_approximate_conversion
@@ -763,33 +1665,60 @@ def cli(input_dir, output_dir, chain_file, test_mode, file_indexing, segment_inp
 
 
     # create a directory for temp files, this dir is hard coded.
-    os.makedirs(tmp_dir, exist_ok=True)
+    # check directory existance
+    try:
+        os.makedirs(tmp_dir, exist_ok=True)
+        os.makedirs(log_dir, exist_ok=True)
+    except OSError as e:
+        sys.exit('Error: output directory {} can not be created: {}'.format(output_dir, e))
+    if not os.access(output_dir, os.W_OK):
+        sys.exit('Error: output directory {} is not writable.'.format(output_dir))
     
     ################### loggers ###################
     
-    # check directory existance
-    os.makedirs(log_dir, exist_ok=True)
-    
+    # An interrupted run of the same job is resumed automatically:
+    # its checkpoint is still there, and describes the same job.
+    checkpoint_path = os.path.join(log_dir, 'checkpoint.json')
+    job = {'input_dir': os.path.abspath(input_dir), 'output_dir': os.path.abspath(output_dir),
+           'chain_file': chain_paths, 'segment_input_file': segment_input_file,
+           'probe_input_file': probe_input_file, 'segment_output_file': segment_output_file,
+           'probe_output_file': probe_output_file, 'index_file': index_file.name if index_file else None,
+           'resume': list(resume_files) if resume_files else None, 'test_mode': test_mode,
+           'approximate_mode': approximate_mode, 'step_size': step_size, 'range': search_range,
+           'beta': beta, 'remap_flag': remap_flag, 'new_segment_header': list(new_segment_header or []),
+           'new_probe_header': list(new_probe_header or []), 'incremental': incremental,
+           'output_format': output_format, 'engine': 'liftOver' if liftover_path else 'builtin',
+           'liftover_path': os.path.abspath(liftover_path) if liftover_path else None}
+    auto_resume = (not no_resume) and (not file_indexing) and (loadCheckpoint(checkpoint_path) == job) and \
+                  os.path.isfile(os.path.join(log_dir, 'fileList.log'))
+
+    # logs of a resumed run are appended to the ones of the interrupted run
+    log_mode = 'a' if auto_resume else 'w'
+
     # system logger 
     logger = logging.getLogger('liftover')
-    handler = logging.FileHandler(os.path.join(log_dir, 'general.log'), mode='w', delay=True)
+    handler = logging.FileHandler(os.path.join(log_dir, 'general.log'), mode=log_mode, delay=True)
     handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
     logger.setLevel(logging.INFO)
     logger.addHandler(handler)
     
     # prgress logger, records processed files, used for restore.
+    # It is an append only journal when resuming, synced every progress_sync files.
     progress_logger = logging.getLogger('progress')
-    handler = logging.FileHandler(os.path.join(log_dir,'progress.log'), mode='w', delay=True)
-    handler.setFormatter(logging.Formatter('%(message)s'))
+    progress_handler = JournalHandler(os.path.join(log_dir,'progress.log'), mode=log_mode, sync_every=progress_sync)
+    progress_handler.setFormatter(logging.Formatter('%(message)s'))
     progress_logger.setLevel(logging.INFO)
-    progress_logger.addHandler(handler)
+    progress_logger.addHandler(progress_handler)
     
     # unmapped positions logger, records segments that's not properly lifted.
     unmapped_logger = logging.getLogger('unmapped')
-    handler = logging.FileHandler(os.path.join(log_dir,'unconverted.log'), mode='w', delay=True)
+    handler = logging.FileHandler(os.path.join(log_dir,'unconverted.log'), mode=log_mode, delay=True)
     handler.setFormatter(logging.Formatter('%(message)s'))
     unmapped_logger.setLevel(logging.INFO)
     unmapped_logger.addHandler(handler)
+    global unmapped_logger_header
+    if auto_resume and os.path.isfile(os.path.join(log_dir,'unconverted.log')):
+        unmapped_logger_header = True
 
 
 
@@ -802,7 +1731,8 @@ def cli(input_dir, output_dir, chain_file, test_mode, file_indexing, segment_inp
         print('Parameters:', file=fo )
         print('input_dir: {}'.format(input_dir), file=fo )
         print('output_dir: {}'.format(output_dir), file=fo )
-        print('chain_file: {}'.format(chain_file), file=fo )
+        print('chain_file: {}'.format(' '.join(chain_paths)), file=fo )
+        print('liftover: {}'.format(liftover_path), file=fo )
         print('test_mode: {}'.format(test_mode), file=fo )
         print('file_indexing: {}'.format(file_indexing), file=fo )
         print('segment_input_file: {}'.format(segment_input_file), file=fo )
@@ -811,13 +1741,23 @@ def cli(input_dir, output_dir, chain_file, test_mode, file_indexing, segment_inp
         print('probe_output_file: {}'.format(probe_output_file), file=fo )
         print('setp_size: {}'.format(step_size_usr), file=fo )
         print('range: {}'.format( search_range ), file=fo )
+        print('approximate_mode: {}'.format( approximate_mode ), file=fo )
         print('beta: {}'.format( beta ), file=fo)
         print('index_file: {}'.format( index_file.name if index_file else index_file ), file=fo )
         print('mapping_file: {}'.format( mapping_file.name if mapping_file else mapping_file), file=fo )
+        print('cache_file: {}'.format( cache_file ), file=fo )
         print('no_approximate_conversion: {}'.format( no_approximate_conversion ), file=fo)
         print('new_segment_header: {}'.format( new_segment_header), file=fo)
         print('new_probe_header: {}'.format( new_probe_header), file=fo)
         print('log_path: {}'.format(log_dir), file=fo)
+        print('jobs: {}'.format(jobs), file=fo)
+        print('chunk_size: {}'.format(chunk_size), file=fo)
+        print('batch_size: {}'.format(batch_size), file=fo)
+        print('batch_rows: {}'.format(batch_rows), file=fo)
+        print('prefetch: {}'.format(prefetch), file=fo)
+        print('profile: {}'.format(profile), file=fo)
+        print('output_format: {}'.format(output_format), file=fo)
+        print('incremental: {}'.format(incremental), file=fo)
         print( file=fo)
 
 
@@ -840,8 +1780,17 @@ def cli(input_dir, output_dir, chain_file, test_mode, file_indexing, segment_inp
                 #         break
 
     global file_list
+    # resume an interrupted run, without indexing again
+    if auto_resume:
+        with open(os.path.join(log_dir, 'fileList.log'), 'r') as fi:
+            resume_index = [line.strip() for line in fi]
+        resume_progress = readJournal(os.path.join(log_dir, 'progress.log'))
+        file_list = [f for f in resume_index if f not in resume_progress]
+        print('Resume from previous interruption, {} files processed, {} files to go.'.format(
+                len(resume_index)-len(file_list), len(file_list)))
+
     # resume function
-    if len(resume_files) >0:
+    elif resume_files:
         if not os.path.isfile(resume_files[0]):
             sys.exit('--resume: index file does not exist.')
         if not os.path.isfile(resume_files[1]):
@@ -874,28 +1823,35 @@ def cli(input_dir, output_dir, chain_file, test_mode, file_indexing, segment_inp
         print('Indexing files to process, this may take some time.')
         seg_counter = 0
         pro_counter = 0
-        with click.progressbar(os.walk(input_dir), label='Be patient: ', fill_char=click.style('*', fg='red')) as bar:
-
-
-            # File traverse
-            for root, subdirs, files in bar:
-                for f in files:
-#                    if (f == segment_input_file):
-                    if (segment_input_file !=None) and  (seg_pattern.match(f)):
-                        path = os.path.join(root,f)
-                        file_list.append(path)
+        # File traverse, directories unchanged since the last run
+        # are taken from the saved index
+        patterns = [segment_input_file, probe_input_file]
+        def match(f):
+            if (segment_input_file !=None) and  (seg_pattern.match(f)):
+                return 'segment'
+            elif (probe_input_file !=None) and (pro_pattern.match(f)):
+                return 'probe'
+        index_path = os.path.join(log_dir, 'fileIndex.json')
+        index_cache = loadFileIndex(index_path, input_dir, patterns)
+        # test mode
+        limit = test_mode + 1 if test_mode else None
+        scanned = []
+        scan_time = int(time.time() * 10**9)
+        with click.progressbar(scanDirectories(input_dir, match, index_cache, limit), 
+                               label='Be patient: ', fill_char=click.style('*', fg='red')) as bar:
+            for tree in bar:
+                scanned.extend(tree)
+
+            for root, (mtime, subdirs, files) in scanned:
+                root = os.path.join(input_dir, root) if root else input_dir
+                for f, kind in files:
+                    file_list.append(os.path.join(root,f))
+                    if kind == 'segment':
                         seg_counter += 1
-#                    elif(f == probe_input_file):
-                    elif (probe_input_file !=None) and (pro_pattern.match(f)):
-                        path = os.path.join(root,f)
-                        file_list.append(path)
+                    else:
                         pro_counter += 1
-                
-                # test mode
-                if test_mode:
-                    test_counter += 1
-                    if test_counter > test_mode:
-                        break
+            if not test_mode:
+                saveFileIndex(index_path, input_dir, patterns, dict(scanned), scan_time)
 
             # Save the file list to disk
             with open(os.path.join(log_dir, 'fileList.log'), 'w') as fo:
@@ -907,6 +1863,12 @@ def cli(input_dir, output_dir, chain_file, test_mode, file_indexing, segment_inp
                 sys.exit('Indexing file created.')
         print('detected {} segment files and {} probe files.\n'.format(seg_counter, pro_counter))
 
+    # Save the file list of a resumed or indexed run to disk, for checkpoints
+    if (not auto_resume) and (resume_files or index_file):
+        with open(os.path.join(log_dir, 'fileList.log'), 'w') as fo:
+            for line in file_list:
+                print(line,file=fo)
+
 
 
 
@@ -922,19 +1884,38 @@ def cli(input_dir, output_dir, chain_file, test_mode, file_indexing, segment_inp
     #             remapped_list[key] = [chro, pos, flag]
     #     print('Remapped positions detected, recovered from ./logs/remapped.log')
 
+    # the checksum of the mapping file is part of the fingerprints of
+    # incremental runs, it is computed while the file is read
+    global remapped_list
+    remapped_list = RemapTable()
+    mapping_checksum = 'none'
     if mapping_file:
-        if len(next(mapping_file).split('\t')) != 4:
+        header = next(mapping_file)
+        if len(header.split('\t')) != 4:
             sys.exit('Wrong position mapping file.')
-        for line in mapping_file:
-            line = line.strip().split('\t')
-            key = line[0]
-            chro = line[1]
-            pos = int(line[2])
-            flag = line[3]
-            remapped_list[key] = [chro, pos, flag]
+        md5 = hashlib.md5(header.encode())
+        def hashedLines(lines):
+            for line in lines:
+                md5.update(line.encode())
+                yield line
+        remapped_list.read(hashedLines(mapping_file))
+        mapping_checksum = md5.hexdigest()
         print('Position mapping file detected, recovered from {}'.format(mapping_file.name))
 
-        
+    # Open the persistent store of approximate conversion results,
+    # worker processes open their own connections
+    global remap_store
+    if not remap_flag:
+        cache_file = None
+    if cache_file:
+        try:
+            remap_store = RemapStore(cache_file)
+        except Exception as e:
+            sys.exit('Error: cache file {} can not be opened: {}'.format(cache_file, e))
+        print('Approximate conversion cache: {}'.format(cache_file))
+        if jobs > 1:
+            remap_store.close()
+            remap_store = None
 
 
 
@@ -944,46 +1925,110 @@ def cli(input_dir, output_dir, chain_file, test_mode, file_indexing, segment_inp
     pro_succ_counter = 0
     pro_fail_counter = 0
     #########   Liftover   ############
-    with click.progressbar(file_list, label='Lifting: ', fill_char=click.style('*', fg='green')) as bar:
-
-        
-        for f in bar:
-            #generate output path
-            rel_path = os.path.relpath(os.path.dirname(f), input_dir)
-            #out_path = os.path.join(output_dir, rel_path, os.path.basename(f))
-
-
-            
-            # lift over
-#            if os.path.basename(f) == segment_input_file:
-            # if ((segment_input_file !=None) or (index_file != None)) and  (seg_pattern.match(os.path.basename(f))):
-            if (segment_input_file !=None) and  (seg_pattern.match(os.path.basename(f))):
-                if segment_output_file == None:
-                    segment_output_file_dynamic = seg_pattern.match(os.path.basename(f)).group(0)
-                    segment_out_path = os.path.join(output_dir, rel_path, segment_output_file_dynamic)
-                else:
-                    segment_out_path = os.path.join(output_dir, rel_path, segment_output_file)
-                code = convertSegments(f, segment_out_path, chain_file,remapped_list, 
-                                       remap_flag, new_segment_header)
+    options = {'input_dir': input_dir, 'output_dir': output_dir, 'chain_file': chain_file,
+               'seg_pattern': seg_pattern, 'pro_pattern': pro_pattern, 
+               'segment_output_file': segment_output_file, 'probe_output_file': probe_output_file,
+               'remap_flag': remap_flag, 'new_segment_header': new_segment_header or [],
+               'new_probe_header': new_probe_header or []}
+
+    # Skip files converted by a previous run with the same settings,
+    # if neither the input nor the output has changed since
+    manifest = None
+    if incremental:
+        manifest = Manifest(os.path.join(log_dir, 'manifest.sqlite'))
+        file_settings = {'segment': list(remapStoreParams(chain_file)) + [beta, remap_flag, options['new_segment_header'], output_format, mapping_checksum],
+                         'probe': list(remapStoreParams(chain_file)) + [beta, remap_flag, options['new_probe_header'], output_format, mapping_checksum]}
+        fingerprints = {}
+        todo = []
+        for f in file_list:
+            kind, out_path = outputPath(f, options)
+            try:
+                fingerprints[f] = fileFingerprint(f, file_settings[kind])
+            except (KeyError, OSError):
+                todo.append(f)
+                continue
+            if not manifest.isCurrent(f, fingerprints[f], out_path):
+                todo.append(f)
+        print('Incremental run: {} files unchanged, {} files to process.'.format(len(file_list) - len(todo), len(todo)))
+        file_list = todo
+
+    # profile file conversions, in this process or in the workers
+    global profiler
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        for path in glob.glob(os.path.join(log_dir, 'profile_worker_*.pstats')):
+            os.remove(path)
+
+    # NumPy and pandas are imported before the files, once for all
+    # worker processes, and not counted in the time of the first file
+    preload(np, pd)
+
+    # the chain is loaded before the files, its time is not counted in theirs
+    chain_start = time.perf_counter()
+    if not liftover_path:
+        getChainIndex(chain_file)
+    chain_seconds = time.perf_counter() - chain_start
+
+    # the checkpoint is saved once nothing can stop the job before its
+    # first file, a job that did not start is not resumed
+    if not auto_resume:
+        saveCheckpoint(checkpoint_path, job)
+
+    # one file, or one batch of files, at a time
+    if jobs == 1:
+        results = liftFiles(file_list, options, remapped_list)
+
+    # spread files over a process pool,
+    # workers send back their log records, counters and remapped positions
+    else:
+        logUnmappedHeader()
+        settings = {'tmp_dir': tmp_dir, 'liftover_path': liftover_path, 'beta': beta,
+                    'approximate_mode': approximate_mode, 'search_distance': search_distance,
+                    'step_size': step_size, 'steps': steps, 'remapped_list': remapped_list,
+                    'cache_file': cache_file, 'chunk_size': chunk_size, 'output_format': output_format,
+                    'batch_size': batch_size, 'batch_rows': batch_rows, 'prefetch': prefetch,
+                    'profile_dir': log_dir if profile else None}
+        import multiprocessing
+        log_queue = multiprocessing.Queue()
+        listener = QueueListener(log_queue, LogDispatcher())
+        listener.start()
+        pool = multiprocessing.Pool(jobs, initializer=initWorker, initargs=(settings, log_queue))
+        # each task is a batch of files
+        tasks = [file_list[i:i + batch_size] for i in range(0, len(file_list), batch_size)]
+        pool_chunks = max(1, min(16, len(tasks) // (jobs*4)))
+
+        def collect(worker_results):
+            for file_results, counters, failed, new_remapped, worker_metrics in worker_results:
+                addCounters(counters)
+                metrics.merge(worker_metrics)
+                failed_files.extend(failed)
+                remapped_list.update(new_remapped)
+                for result in file_results:
+                    yield result
+
+        results = collect(pool.imap_unordered(partial(liftWorker, options=options), tasks, pool_chunks))
+
+    with click.progressbar(results, length=len(file_list), label='Lifting: ', 
+                           fill_char=click.style('*', fg='green')) as bar:
+        for f, kind, code in bar:
+            if (manifest is not None) and (code == 0):
+                manifest.record(f, fingerprints[f], outputPath(f, options)[1])
+            if kind == 'segment':
                 if code == 0:
                     seg_succ_counter += 1
                 else:
                     seg_fail_counter += 1
-#            elif os.path.basename(f) == probe_input_file:
-            # elif ((probe_input_file !=None) or (index_file !=None )) and (pro_pattern.match(os.path.basename(f))):
-            elif (probe_input_file !=None)  and (pro_pattern.match(os.path.basename(f))):
-                if probe_output_file == None:
-                    probe_output_file = pro_pattern.match(os.path.basename(f)).group(0)
-                probe_out_path = os.path.join(output_dir, rel_path, probe_output_file)
-                code = convertProbes(f, probe_out_path, chain_file, remapped_list, 
-                                     remap_flag, new_probe_header)
+            elif kind == 'probe':
                 if code == 0:
                     pro_succ_counter += 1
                 else:
                     pro_fail_counter += 1
-            else:
-                print('Unknown file type: ' + f)
-                logger.error('Unknown file type: ' + f)
+
+    if jobs > 1:
+        pool.close()
+        pool.join()
+        listener.stop()
     
     if (seg_succ_counter + seg_fail_counter) >0:
         print('Segment files: {} processed, {} failed.'.format(seg_succ_counter, seg_fail_counter ))
@@ -1007,23 +2052,112 @@ def cli(input_dir, output_dir, chain_file, test_mode, file_indexing, segment_inp
 
     # Save the remapped_list for reuse
     with open(os.path.join(log_dir,'approximate_conversion.log'), 'w') as fo:
-        print('{}\t{}\t{}\t{}'.format('name', 'new_chr', 'new_pos', 'result'), file=fo)
-        for k,v in remapped_list.items():
-            print(k, end='', file=fo)
-            for i in v:
-                print('\t{}'.format(i), end='', file=fo)
-            print('', file=fo)
+        remapped_list.write(fo)
             
+    if remap_store is not None:
+        remap_store.close()
+    if manifest is not None:
+        manifest.close()
+
     # Save failed files
     if len(failed_files) >0:
         with open(os.path.join(log_dir,'failed_files.log'), 'w') as fo:
             for line in failed_files:
                 print(line, file=fo)
+
+    # The job is finished, the next run starts a new one
+    progress_handler.close()
+    clearCheckpoint(checkpoint_path)
     # Remove temp files.
 #    subprocess.run('rm *.bed *.unmapped ./tmp/*.*  &>/dev/null', shell=True)
 #    subprocess.run('rm -rf tmp', shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Save the metrics of the run
+    summary = {'seconds': (datetime.now() - startTime).total_seconds(),
+               'chain_seconds': chain_seconds,
+               'jobs': jobs,
+               'segments': {'total': total_seg, 'lifted': lifted_seg, 'remapped': remapped_seg,
+                            'rejected': rejected_seg, 'unmapped': unmapped_seg},
+               'probes': {'total': total_pro, 'lifted': lifted_pro, 'remapped': remapped_pro,
+                          'rejected': rejected_pro, 'unmapped': unmapped_pro},
+               'failed_files': len(failed_files)}
+    metrics.write(os.path.join(log_dir, 'metrics.json'), os.path.join(log_dir, 'metrics.csv'), summary)
+    if profiler is not None:
+        saveProfile(profiler, jobs)
+
     print('Done! Finished in {}'.format(datetime.now() - startTime))
 
+# Save the profile of file conversions as profile.pstats, and the
+# functions taking the most time as profile.txt, in log_dir.
+# The profiles saved by worker processes are merged into it.
+def saveProfile(profiler, jobs):
+
+    profile_path = os.path.join(log_dir, 'profile.pstats')
+    worker_files = glob.glob(os.path.join(log_dir, 'profile_worker_*.pstats'))
+    paths = worker_files
+    if jobs == 1:
+        profiler.dump_stats(profile_path)
+        paths = [profile_path]
+    if paths:
+        import pstats
+        with open(os.path.join(log_dir, 'profile.txt'), 'w') as fo:
+            stats = pstats.Stats(*paths, stream=fo)
+            stats.dump_stats(profile_path)
+            stats.sort_stats('cumulative').print_stats(40)
+    for path in worker_files:
+        os.remove(path)
+
+
+
+
+# Compile chain files into binary indexes for the built-in engine
+@click.command()
+@click.argument('chain_files', nargs=-1, required=True)
+@click.option('-d', '--output_dir', default='.', help='The directory to write compiled indexes (default: current directory).')
+def compileCli(chain_files, output_dir):
+
+    if os.path.isdir(output_dir) == False:
+        sys.exit('Error: output directory {} does not exist.'.format(output_dir))
+
+    for chain_file in chain_files:
+        chain_path = findChain(chain_file, compiled=False)
+        if chain_path is None:
+            sys.exit('Error: chainfile {} does not exist.'.format(chain_file))
+        if isCompiledChain(chain_path):
+            sys.exit('Error: {} is already a compiled chain index.'.format(chain_file))
+
+        out = os.path.join(output_dir, compiledChainName(chain_path))
+        start = datetime.now()
+        index = compileChain(chain_path, out)
+        print('Compiled {} into {}: {} blocks on {} chromosomes, in {}'.format(
+            chain_path, out, sum(len(v) for v in index.starts.values()), len(index.starts), datetime.now() - start))
+
+
+
+
+@click.command()
+@click.option('-c', '--chain_file', multiple=True, help='A chain to keep loaded, repeat for several chains (default: all bundled chains).')
+@click.option('--host', default='127.0.0.1', help='The address to listen on (default:127.0.0.1).')
+@click.option('--port', default=8000, type=click.IntRange(min=0), help='The port to listen on (default:8000).')
+@click.option('--socket', 'socket_path', type=str, help='Listen on this Unix socket instead of a TCP port.')
+@click.option('--range', 'search_range', default=10, type=click.IntRange(min=1), help='The searching range of approximate conversion (in kilo bases, default:10).')
+@click.option('--beta', 'beta_usr', default=2.0, type=click.FLOAT, help='Parameter in quality control (default:2).')
+@click.option('--no_approximate_conversion', is_flag=True, help='Do not perform approximate conversion, unless a request asks for it.')
+def serveCli(chain_file, host, port, socket_path, search_range, beta_usr, no_approximate_conversion):
+
+    if beta_usr <= 0:
+        sys.exit('Beta must be greater than zero.')
+    chains = list(chain_file) or default_chains
+    for chain in chains:
+        if findChain(chain) is None:
+            sys.exit('Error: chainfile {} does not exist.'.format(chain))
+
+    from segment_liftover.server import serve
+    print('Loading {} chains...'.format(len(chains)))
+    serve(chains, host, port, socket_path, beta_usr, search_range, not no_approximate_conversion)
+
+
+
+
 ##########################################################################
 #
 #                   Main
@@ -1032,11 +2166,16 @@ def cli(input_dir, output_dir, chain_file, test_mode, file_indexing, segment_inp
 def main():    
     try:
         print()
-        cli()
+        if sys.argv[1:2] == ['compile-chain']:
+            compileCli(args=sys.argv[2:], prog_name='segment_liftover compile-chain')
+        elif sys.argv[1:2] == ['serve']:
+            serveCli(args=sys.argv[2:], prog_name='segment_liftover serve')
+        else:
+            cli()
     except Exception as e:
         print(e)
     finally:
-        subprocess.call(['rm','-rf',tmp_dir]) 
+        shutil.rmtree(tmp_dir, ignore_errors=True)
     
 if __name__ == '__main__':
     main()
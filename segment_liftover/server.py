@@ -0,0 +1,296 @@
+import io
+import json
+import os
+import socketserver
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+from segment_liftover.chainIndex import composeChains
+from segment_liftover.liftApi import getChainIndex, liftSegments, liftPositions, LIFTED, REMAPPED, UNMAPPED, REJECTED_CHRO, REJECTED_LENGTH
+from segment_liftover.tableWriter import TableWriter
+from segment_liftover.lazy import LazyModule
+
+pd = LazyModule('pandas')
+
+
+
+##########################################################################
+#
+#                   Liftover service
+#
+##########################################################################
+
+# A local HTTP server converting segment and probe files sent in requests,
+# with the chains loaded once and kept in memory. Files are converted with
+# the built-in chain engine of the library interface, see liftApi, in
+# memory and with the same quality control as the command line.
+#
+# Requests:
+# POST /segments?chain=hg18ToHg19    a segment file as body
+# POST /probes?chain=hg18ToHg19      a probe file as body
+# GET /chains                        the loaded chains, as JSON
+#
+# Query parameters:
+# chain: the chain, repeat it to convert through composed chains
+# beta, range, approximate: see the command line options, approximate=0
+#        turns approximate conversion off
+# status: with status=1, all rows are returned with a status column,
+#         see liftApi, otherwise only the converted ones
+#
+# The response is the converted file, tab separated, with the rows in the
+# input order. The counts of rows are sent as the headers X-Lifted,
+# X-Remapped, X-Rejected and X-Unmapped.
+#
+# Only the chains given at start can be used, by the name or path they
+# were given with. Errors are logged by the server, the client gets a
+# short message only.
+
+# most chains composed by a request
+MAX_COMPOSED = 4
+
+# composed chains kept in memory, the least recently used is dropped
+COMPOSED_CACHE_SIZE = 8
+
+
+
+
+# An error of a request, its message is sent to the client
+class RequestError(ValueError):
+    pass
+
+
+
+
+# The chains of the service, loaded at start
+#
+# Usage:
+# chains = ChainSet(['hg18ToHg19', 'hg19ToHg38'])
+# index = chains.get(['hg18ToHg19', 'hg19ToHg38'])
+class ChainSet:
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.indexes = {name: getChainIndex(name) for name in self.names}
+        self.composed = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    # The ChainIndex of a list of chain names, composed if there
+    # are several, see composeChains()
+    def get(self, names):
+
+        if len(names) == 0:
+            raise RequestError('chain is missing')
+        if len(names) > MAX_COMPOSED:
+            raise RequestError('at most {} chains can be composed'.format(MAX_COMPOSED))
+        for name in names:
+            if name not in self.indexes:
+                raise RequestError('unknown chain, see GET /chains')
+        if len(names) == 1:
+            return self.indexes[names[0]]
+
+        key = tuple(names)
+        with self.lock:
+            if key in self.composed:
+                self.composed.move_to_end(key)
+                return self.composed[key]
+        index = composeChains([self.indexes[name] for name in names])
+        with self.lock:
+            self.composed[key] = index
+            if len(self.composed) > COMPOSED_CACHE_SIZE:
+                self.composed.popitem(last=False)
+        return index
+
+
+# Read a file sent in a request, like the command line reads input files
+def readPayload(body):
+    return pd.read_table(io.BytesIO(body), sep='\t', low_memory=False, keep_default_na=False)
+
+
+
+
+# Convert a segment file, see convertSegments()
+#
+# Params:
+# df: the segment file
+# chain: a ChainIndex, see ChainSet.get()
+# approximate, distance, beta: see liftSegments()
+#
+# Return:
+# the converted file, with the original columns, and the status codes
+def liftSegmentTable(df, chain, approximate, distance, beta):
+
+    df = df.dropna(axis=0, how='any', subset=df.columns[1:4].tolist())
+    df = df.astype({df.columns[2]: int, df.columns[3]: int})
+    return liftSegments(df, chain, approximate, distance, beta)
+
+
+
+
+# Convert a probe file, see convertProbes()
+#
+# Params:
+# df: the probe file, files of 3 columns get a probe ID column
+# chain, approximate, distance: see liftPositions()
+#
+# Return:
+# the converted file, with the original columns, and the status codes
+def liftProbeTable(df, chain, approximate, distance):
+
+    if df.columns.size < 4:
+        df.insert(0, 'probe_id', 'ID_' + df.index.astype(str))
+    df = df.dropna(axis=0, how='any', subset=df.columns[1:3].tolist())
+    df = df.astype({df.columns[2]: int})
+    new_chroms, new_pos, status = liftPositions(df.iloc[:, 1].values, df.iloc[:, 2].values,
+                                                chain, approximate, distance)
+    df_new = df.copy()
+    df_new.iloc[:, 2] = new_pos
+    return df_new, status
+
+
+
+
+# Request handler of the liftover service
+class LiftHandler(BaseHTTPRequestHandler):
+
+    # keep connections open between requests
+    protocol_version = 'HTTP/1.1'
+
+
+    # the headers and the body of a response are sent without
+    # the delay of the Nagle algorithm, TCP connections only
+    def setup(self):
+        self.disable_nagle_algorithm = isinstance(self.client_address, tuple)
+        super().setup()
+
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/chains':
+            self.reply(200, json.dumps(self.server.chains.names), 'application/json')
+        else:
+            self.reply(404, 'Unknown path: {}\n'.format(self.path))
+
+
+    def do_POST(self):
+
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if url.path not in ['/segments', '/probes']:
+            self.reply(404, 'Unknown path: {}\n'.format(url.path))
+            return
+
+        try:
+            params = parse_qs(url.query)
+            chain = self.server.chains.get(params.get('chain', []))
+            try:
+                beta = float(params.get('beta', [self.server.beta])[0])
+                distance = int(params.get('range', [self.server.search_range])[0]) * 1000
+            except ValueError:
+                raise RequestError('range and beta must be numbers')
+            # the same checks as the command line options
+            if not beta > 0:
+                raise RequestError('Beta must be greater than zero.')
+            if distance <= 0:
+                raise RequestError('range must be greater than 0')
+            approximate = params.get('approximate', [str(int(self.server.approximate))])[0] not in ['0', 'false']
+            with_status = params.get('status', ['0'])[0] not in ['0', 'false']
+
+            df = readPayload(body)
+            if url.path == '/segments':
+                df_new, status = liftSegmentTable(df, chain, approximate, distance, beta)
+                float_format = None
+            else:
+                df_new, status = liftProbeTable(df, chain, approximate, distance)
+                float_format = '%.4f'
+        except RequestError as e:
+            self.reply(400, 'Error: {}\n'.format(e))
+            return
+        except Exception as e:
+            self.log_error('could not convert %s: %s: %s', url.path, type(e).__name__, e)
+            self.reply(400, 'Error: the file could not be converted\n')
+            return
+
+        if with_status:
+            df_new = df_new.assign(status=status)
+        else:
+            df_new = df_new[status <= REMAPPED]
+        out = io.StringIO()
+        TableWriter(out, 'tsv', float_format=float_format).write(df_new)
+        counts = {'X-Lifted': (status == LIFTED).sum(),
+                  'X-Remapped': (status == REMAPPED).sum(),
+                  'X-Rejected': ((status == REJECTED_CHRO) | (status == REJECTED_LENGTH)).sum(),
+                  'X-Unmapped': (status == UNMAPPED).sum()}
+        self.reply(200, out.getvalue(), 'text/tab-separated-values', counts)
+
+
+    # Send a response
+    def reply(self, code, text, content_type='text/plain', headers={}):
+
+        data = text.encode()
+        self.send_response(code)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    # clients of a Unix socket have no address
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+
+
+
+# HTTP server on a TCP port, one thread per connection,
+# as http.server.ThreadingHTTPServer of Python 3.7
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+
+
+# HTTP server on a Unix socket, one thread per connection
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+
+
+# Start the liftover service, it runs until interrupted.
+#
+# Params:
+# chains: the chains loaded at start, see getChainIndex()
+# host, port: the address to listen on
+# socket_path: listen on this Unix socket instead, if given
+# beta, search_range, approximate: the defaults of requests
+def serve(chains, host='127.0.0.1', port=8000, socket_path=None, beta=2, search_range=10, approximate=True):
+
+    chain_set = ChainSet(chains)
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, LiftHandler)
+        address = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), LiftHandler)
+        address = 'http://{}:{}'.format(host, server.server_address[1])
+    server.chains = chain_set
+    server.beta = beta
+    server.search_range = search_range
+    server.approximate = approximate
+
+    print('Serving {} chains on {}'.format(len(chains), address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
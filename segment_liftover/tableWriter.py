@@ -0,0 +1,97 @@
+import importlib.util
+import os
+
+
+
+##########################################################################
+#
+#                   Output formats
+#
+##########################################################################
+
+# Converted tables are written as tab separated text, or as columnar
+# Parquet or Feather files with the optional pyarrow package.
+OUTPUT_FORMATS = ['tsv', 'parquet', 'feather']
+
+
+# Check if the optional packages of an output format are installed
+def formatAvailable(output_format):
+    if output_format == 'tsv':
+        return True
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+
+
+# Name of an output file in the given format: the extension of a
+# columnar file is replaced by the format name, text files keep their name.
+def formatFileName(name, output_format):
+    if output_format == 'tsv':
+        return name
+    return os.path.splitext(name)[0] + '.' + output_format
+
+
+
+
+# Write a table in parts to an open file, in one of OUTPUT_FORMATS.
+# A text file is written as the parts come, a columnar file gets one
+# row group (Parquet) or record batch (Feather) per part, with the column
+# types of the first non-empty part.
+#
+# Usage:
+# with AtomicOutput(path, binary=(output_format != 'tsv')) as f:
+#     writer = TableWriter(f, output_format, float_format='%.4f')
+#     writer.write(df)
+#     writer.close()
+class TableWriter:
+
+    def __init__(self, out, output_format, float_format=None):
+        self.out = out
+        self.output_format = output_format
+        self.float_format = float_format
+        self.header = True
+        self.writer = None
+        self.schema = None
+        self.empty = None
+
+
+    # Write a part of the table, the column names are written with the first part
+    def write(self, df):
+
+        if self.output_format == 'tsv':
+            df.to_csv(self.out, sep='\t', index=False, float_format=self.float_format, header=self.header)
+            self.header = False
+            return
+
+        import pyarrow as pa
+        # column types of empty parts are unknown
+        if df.shape[0] == 0:
+            if self.empty is None:
+                self.empty = df
+            return
+        table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        if self.writer is None:
+            self.schema = table.schema
+            self.writer = self.openWriter(table.schema)
+        self.writer.write_table(table)
+
+
+    def openWriter(self, schema):
+        if self.output_format == 'parquet':
+            import pyarrow.parquet as pq
+            return pq.ParquetWriter(self.out, schema)
+        import pyarrow as pa
+        return pa.ipc.new_file(self.out, schema)
+
+
+    # Finish the file, a table without rows keeps its column names
+    def close(self):
+
+        if self.output_format == 'tsv':
+            return
+        if self.writer is None:
+            import pyarrow as pa
+            table = pa.Table.from_pandas(self.empty, preserve_index=False)
+            self.writer = self.openWriter(table.schema)
+            self.writer.write_table(table)
+        self.writer.close()
@@ -23,8 +23,12 @@ setup(name = 'segment_liftover',
     packages = ['segment_liftover'],
     install_requires = [
         'click',
+        'numpy',
         'pandas'
         ],
+    extras_require = {
+        'columnar': ['pyarrow']
+        },
     python_requires = '>=3.6',
     entry_points = {
         'console_scripts': ['segment_liftover = segment_liftover.segmentLiftover:main']
@@ -0,0 +1,140 @@
+import numpy as np
+from segment_liftover.chainIndex import compileChain, composeChains, loadChain, openCompiledChain, parseChain
+
+
+# chr1: two '+' blocks, [100,150) -> [500,550) and [160,300) -> [570,710)
+# chr2: one '-' block, [0,100) -> [389,489] backwards
+# chr1 again: [140,200) -> chr7 [0,60), it overlaps both blocks of the
+# first chain, so [140,150) and [160,200) are "Duplicated in new"
+CHAIN = """chain 1000 chr1 1000 + 100 300 chr1 2000 + 500 710 1
+50 10 20
+140
+
+chain 1000 chr2 1000 + 0 100 chr2 500 - 10 110 2
+100
+
+chain 500 chr1 1000 + 140 200 chr7 1000 + 0 60 3
+60
+"""
+
+# chains composed into one: the images of the first chain partly fall in
+# the gaps and outside the blocks of the second one, on both strands
+FIRST_CHAIN = """chain 1 chr1 1000 + 0 300 chr1 1000 + 100 420 1
+100 20 40
+180
+
+chain 1 chr2 1000 + 50 150 chr2 800 - 200 300 2
+100
+"""
+
+SECOND_CHAIN = """chain 1 chr1 1000 + 150 400 chr1 1000 - 0 240 3
+60 10 0
+180
+
+chain 1 chr2 800 + 450 620 chr5 900 + 0 170 4
+170
+"""
+
+
+
+
+# Write a chain file
+def writeChain(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+
+
+# The nearest base mapped to a chromosome of the same name, base by base,
+# the right one on a tie
+def bruteNearest(index, chro, pos, distance):
+    for d in range(distance + 1):
+        for p in (pos + d, pos - d):
+            new_chros, new_pos, found = index.lift(np.array([chro], dtype=object), [p])
+            if found[0] and new_chros[0] == chro:
+                return new_chros[0], new_pos[0], True
+    return 'NA', -1, False
+
+
+
+
+# Single bases in blocks on both strands, in gaps, outside the blocks,
+# in overlapping blocks and on unknown chromosomes
+def test_lift(tmp_path):
+
+    index = parseChain(writeChain(tmp_path, 'test.chain', CHAIN))
+    cases = [('chr1', 100, 'chr1', 500), ('chr1', 139, 'chr1', 539),
+             ('chr1', 140, 'NA', -1), ('chr1', 149, 'NA', -1),
+             ('chr1', 150, 'chr7', 10), ('chr1', 159, 'chr7', 19),
+             ('chr1', 160, 'NA', -1), ('chr1', 199, 'NA', -1),
+             ('chr1', 200, 'chr1', 610), ('chr1', 299, 'chr1', 709),
+             ('chr1', 99, 'NA', -1), ('chr1', 300, 'NA', -1),
+             ('chr2', 0, 'chr2', 489), ('chr2', 99, 'chr2', 390),
+             ('chr2', 100, 'NA', -1), ('chr3', 5, 'NA', -1)]
+
+    new_chros, new_pos, found = index.lift(np.array([c[0] for c in cases], dtype=object),
+                                           [c[1] for c in cases])
+    assert list(new_chros) == [c[2] for c in cases]
+    assert list(new_pos) == [c[3] for c in cases]
+    assert list(found) == [c[3] != -1 for c in cases]
+
+
+
+
+# nearest() against a base by base search, blocks mapped to
+# another chromosome are not used
+def test_nearest(tmp_path):
+
+    index = parseChain(writeChain(tmp_path, 'test.chain', CHAIN))
+    distance = 30
+    chros = np.array(['chr1'] * 400 + ['chr2'] * 200 + ['chr3'], dtype=object)
+    positions = list(range(400)) + list(range(200)) + [5]
+
+    new_chros, new_pos, found = index.nearest(chros, positions, distance)
+    for i in range(len(positions)):
+        assert (new_chros[i], new_pos[i], found[i]) == bruteNearest(index, chros[i], positions[i], distance)
+
+
+
+
+# A composed chain converts positions the same as both chains in turn
+def test_composeChains(tmp_path):
+
+    first = parseChain(writeChain(tmp_path, 'first.chain', FIRST_CHAIN))
+    second = parseChain(writeChain(tmp_path, 'second.chain', SECOND_CHAIN))
+    composed = composeChains([first, second])
+    chros = np.array(['chr1'] * 1000 + ['chr2'] * 1000 + ['chr3'], dtype=object)
+    positions = list(range(1000)) + list(range(1000)) + [5]
+
+    mid_chros, mid_pos, mid_found = first.lift(chros, positions)
+    new_chros, new_pos, found = second.lift(mid_chros, mid_pos)
+    got_chros, got_pos, got_found = composed.lift(chros, positions)
+    assert found.sum() > 0 and (mid_found & ~found).sum() > 0
+    assert list(got_found) == list(found)
+    assert list(got_chros) == list(new_chros)
+    assert list(got_pos) == list(new_pos)
+
+
+
+
+# A compiled index opened with np.memmap converts positions
+# the same as the chain file
+def test_compiledChain(tmp_path):
+
+    path = writeChain(tmp_path, 'test.chain', CHAIN)
+    out = str(tmp_path / 'test.chain.cidx')
+    index = compileChain(path, out)
+    compiled = openCompiledChain(out)
+    assert isinstance(compiled.starts['chr1'], np.memmap)
+    assert compiled.checksum == index.checksum
+    assert isinstance(loadChain(out).starts['chr1'], np.memmap)
+
+    chros = np.array(['chr1'] * 400 + ['chr2'] * 200 + ['chr3'], dtype=object)
+    positions = list(range(400)) + list(range(200)) + [5]
+    for method, args in [('lift', ()), ('nearest', (30,))]:
+        expected = getattr(index, method)(chros, positions, *args)
+        got = getattr(compiled, method)(chros, positions, *args)
+        for e, g in zip(expected, got):
+            assert list(e) == list(g)
@@ -0,0 +1,58 @@
+import numpy as np
+from segment_liftover.remapCache import RemapTable
+
+
+
+
+# Many small adds, with positions added again and chromosomes converted
+# to other ones, are checked against a dict after every add. DELTA_SIZE
+# is small so that the delta is merged into the sorted keys many times.
+def test_manySmallAdds(monkeypatch):
+
+    monkeypatch.setattr(RemapTable, 'DELTA_SIZE', 16)
+    rng = np.random.default_rng(1)
+    table = RemapTable()
+    expected = {}
+    chro_names = np.array(['chr1', 'chr2', 'chrX'], dtype=object)
+
+    for step in range(300):
+        n = int(rng.integers(1, 6))
+        chros = chro_names[rng.integers(0, 3, n)]
+        positions = rng.integers(0, 200, n)
+        new_chros = chro_names[rng.integers(0, 3, n)]
+        new_pos = rng.integers(0, 10**9, n)
+        mapped = rng.random(n) < 0.8
+        table.add(chros, positions, new_chros, new_pos, mapped)
+        for i in range(n):
+            expected[(chros[i], int(positions[i]))] = (new_chros[i], int(new_pos[i]), bool(mapped[i]))
+
+        assert len(table) == len(expected)
+        keys = list(expected)
+        found, got_chros, got_pos, got_mapped = table.get(np.array([k[0] for k in keys], dtype=object),
+                                                          [k[1] for k in keys])
+        assert found.all()
+        for i, key in enumerate(keys):
+            assert (got_chros[i], int(got_pos[i]), bool(got_mapped[i])) == expected[key]
+
+        found, got_chros, got_pos, _ = table.get(np.array(['chr1', 'chrY'], dtype=object), [500, 1])
+        assert not found.any()
+        assert list(got_chros) == ['NA', 'NA'] and list(got_pos) == [-1, -1]
+
+
+
+
+# Entries keep the order they were added in, with their last result
+def test_entriesOrder():
+
+    table = RemapTable()
+    table.add(np.array(['chr1', 'chr1'], dtype=object), [5, 3],
+              np.array(['chr1', 'chr1'], dtype=object), [50, 30], [True, True])
+    table.add(np.array(['chr2', 'chr1'], dtype=object), [1, 5],
+              np.array(['chr2', 'NA'], dtype=object), [10, -1], [True, False])
+
+    chros, positions, new_chros, new_pos, mapped = table.entries()
+    assert list(zip(chros, positions)) == [('chr1', 5), ('chr1', 3), ('chr2', 1)]
+    assert list(new_chros) == ['NA', 'chr1', 'chr2']
+    assert list(new_pos) == [-1, 30, 10]
+    assert list(mapped) == [False, True, True]
+    assert len(table.since(2)) == 1